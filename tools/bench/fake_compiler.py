@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""Stand-in for a compiler driver, for benchmarking do_test.py without a compiler.
+
+It understands -E (optionally with -dM), -D, -std= and -x c++ - (input from stdin),
+and ignores other options. It predefines __cplusplus and the feature-test macros that
+data.yaml says the implementation FAKE_CC_IMPL (default gcc) defines in the
+configuration, so the generated tests pass, except for the macros picked by
+FAKE_CC_ERRORS=N (about one in N), whose values are off by one. Every run first
+sleeps FAKE_CC_LATENCY seconds. The macros of each configuration are cached under
+.cache/fake_compiler."""
+import hashlib, json, os, pathlib, re, sys, time, zlib
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from utilities import kinds, implementations, standard_values, std_options, evaluate_condition, expected_value, atomic_write, FeatureDB
+
+std_of = {std_opt: std for impl in implementations for std, std_opt in std_options(impl)}
+directive = re.compile(r'\s*#\s*(\w+)\s*(.*)')
+has_cpp_attribute = re.compile(r'__has_cpp_attribute\s*\(\s*(\w+)\s*\)')
+# The fake compiler has no builtins, includes or extensions to report.
+has_feature = re.compile(r'__has_\w+\s*\([^()]*\)')
+identifier = re.compile(r'[A-Za-z_]\w*')
+
+def configuration_macros(data, impl, std, defines, errors):
+    """The macros predefined in a configuration, and the values of __has_cpp_attribute."""
+    path = pathlib.Path(data)
+    stat = path.stat()
+    key = hashlib.sha256(json.dumps([str(path.resolve()), stat.st_mtime_ns, stat.st_size, impl, std, defines, errors]).encode()).hexdigest()
+    cache = pathlib.Path('.cache/fake_compiler') / f'{key[:16]}.json'
+    try:
+        return json.loads(cache.read_text())
+    except (OSError, ValueError):
+        pass
+
+    db = FeatureDB.load(data)
+    macros = {'__cplusplus': f'{standard_values[std]}L', **dict(defines)}
+    attributes = {}
+    # Conditions may refer to macros listed later, so the values are computed twice.
+    for _ in range(2):
+        for kind in kinds:
+            for macro in db[kind]:
+                try:
+                    value = expected_value(macro, impl, macros)
+                except ValueError:
+                    value = None
+                if value is not None and errors and zlib.crc32(macro.name.encode()) % errors == 0:
+                    value -= 1
+                if kind == 'attributes':
+                    attributes[macro.name] = value or 0
+                elif value is not None:
+                    macros[macro.name] = f'{value}L'
+    result = [macros, attributes]
+    atomic_write(cache, json.dumps(result))
+    return result
+
+def preprocess(text, filename, macros, attributes, out, err):
+    """Preprocess text like `-E` would, as far as the generated tests need. Returns
+    whether any #error was reached."""
+    stack = []  # (whether the group is being processed, whether a branch was taken)
+    active = True
+    failed = False
+    lineno = 0
+    condition = lambda expr: evaluate_condition(has_feature.sub('0', has_cpp_attribute.sub(lambda match: str(attributes.get(match[1], 0)), expr)), macros)
+    for line in text.splitlines():
+        lineno += 1
+        match = directive.match(line)
+        if not match:
+            if active:
+                line = has_cpp_attribute.sub(lambda match: str(attributes.get(match[1], 0)), line)
+                out.append(identifier.sub(lambda match: macros.get(match[0]) or match[0], line))
+            continue
+        name, rest = match.groups()
+        if name in ['if', 'ifdef', 'ifndef']:
+            if active:
+                taken = bool(condition(rest) if name == 'if' else (rest.split()[0] in macros) == (name == 'ifdef'))
+            else:
+                taken = True
+            stack.append((active, taken))
+            active = active and taken
+        elif name == 'elif':
+            outer, taken = stack[-1]
+            active = outer and not taken and bool(condition(rest))
+            stack[-1] = (outer, taken or active)
+        elif name == 'else':
+            outer, taken = stack[-1]
+            active = outer and not taken
+            stack[-1] = (outer, True)
+        elif name == 'endif':
+            active = stack.pop()[0]
+        elif not active:
+            continue
+        elif name == 'line':
+            number, *file = rest.split(maxsplit=1)
+            lineno = int(number) - 1
+            if file:
+                filename = file[0].strip('"')
+        elif name == 'define':
+            macro, *value = rest.split(maxsplit=1)
+            macros[macro] = value[0] if value else ''
+        elif name == 'undef':
+            macros.pop(rest.strip(), None)
+        elif name == 'error':
+            err.append(f'{filename}:{lineno}:{match.start(1) + 1}: error: #error {rest}\n')
+            failed = True
+    return failed
+
+def main(argv):
+    time.sleep(float(os.environ.get('FAKE_CC_LATENCY', 0)))
+    std, defines, dump, source = 'C++17', [], False, None
+    args = iter(argv)
+    for arg in args:
+        if arg in std_of:
+            std = std_of[arg]
+        elif arg.startswith('-std'):
+            sys.exit(f'fake_compiler: error: unrecognized command-line option {arg!r}')
+        elif arg == '-D':
+            defines.append(next(args))
+        elif arg.startswith('-D'):
+            defines.append(arg[2:])
+        elif arg == '-dM':
+            dump = True
+        elif arg == '-x':
+            next(args)
+        elif arg == '-' or not arg.startswith('-'):
+            source = arg
+    if source is None:
+        sys.exit('fake_compiler: fatal error: no input files')
+
+    defines = [(name, value or '1') for name, _, value in (define.partition('=') for define in defines)]
+    impl = os.environ.get('FAKE_CC_IMPL', 'gcc')
+    macros, attributes = configuration_macros(os.environ.get('FAKE_CC_DATA', 'data.yaml'), impl, std, defines,
+                                              int(os.environ.get('FAKE_CC_ERRORS', 0)))
+    text = sys.stdin.read() if source == '-' else open(source, encoding='utf-8').read()
+    out, err = [], []
+    failed = preprocess(text, '<stdin>' if source == '-' else source, macros, attributes, out, err)
+    if dump:
+        out = [f'#define {name} {value}' for name, value in sorted(macros.items())]
+    sys.stdout.write(''.join(line + '\n' for line in out))
+    sys.stderr.write(''.join(err))
+    return int(failed)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
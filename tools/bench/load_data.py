@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import argparse, pathlib, shutil, sys, tempfile, timeit, yaml
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from utilities import load_data
+
+parser = argparse.ArgumentParser(description='Compare the ways of loading data.yaml.')
+parser.add_argument('data', nargs='?', default='data.yaml', help='File to load (default: %(default)s)')
+parser.add_argument('-n', '--number', type=int, default=10, help='Number of loads to average over')
+args = parser.parse_args()
+
+snapshot_dir = tempfile.mkdtemp()
+
+def cold():
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    load_data(args.data, snapshot_dir)
+
+def warm():
+    load_data(args.data, snapshot_dir)
+
+candidates = {
+    'yaml.SafeLoader': lambda: yaml.load(open(args.data, encoding='utf-8'), Loader=yaml.SafeLoader),
+    'yaml.CSafeLoader': lambda: yaml.load(open(args.data, encoding='utf-8'), Loader=yaml.CSafeLoader),
+    'load_data (cold)': cold,
+    'load_data (warm)': warm,
+}
+if not hasattr(yaml, 'CSafeLoader'):
+    print('PyYAML was built without libyaml, skipping yaml.CSafeLoader')
+    del candidates['yaml.CSafeLoader']
+
+warm()
+for name, load in candidates.items():
+    print(f'{name:20} {timeit.timeit(load, number=args.number) / args.number * 1000:8.2f} ms')
+
+shutil.rmtree(snapshot_dir, ignore_errors=True)
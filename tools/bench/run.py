@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Benchmarks of the tools on data.yaml and on copies scaled by scale_data.py.
+
+In-process benchmarks time the YAML load and test generation; the table rendering,
+the version.def import and do_test.py are timed as separate processes, run in
+.cache/bench/x{scale} with fake_compiler.py standing in for the compiler."""
+import argparse, json, os, pathlib, platform, subprocess, sys, time
+tools = pathlib.Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(tools))
+from utilities import kinds, implementations, load_data, parse_data, atomic_write, FeatureDB, TestsuiteGenerator
+
+def best_of(repeat, function):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+def prepare_workdir(scale):
+    """.cache/bench/x{scale} with the scaled data.yaml and a matching version.def, made once per data.yaml."""
+    workdir = pathlib.Path('.cache/bench') / f'x{scale}'
+    data = workdir / 'data.yaml'
+    if not data.exists() or data.stat().st_mtime_ns < pathlib.Path('data.yaml').stat().st_mtime_ns:
+        workdir.mkdir(parents=True, exist_ok=True)
+        subprocess.run([sys.executable, tools / 'bench' / 'scale_data.py', str(scale), '-o', data.resolve(),
+                        '--version-def', (workdir / 'version.def').resolve()], check=True)
+    return workdir
+
+def generate_all(db):
+    for kind in kinds:
+        for impl in implementations:
+            generator = TestsuiteGenerator(kind, impl)
+            for macro in db[kind]:
+                list(generator.make_options(macro))
+                generator.generate_test_item(macro)
+
+def run_tool(workdir, *args, env={}):
+    subprocess.run([sys.executable, *map(str, args)], cwd=workdir, check=True, stdout=subprocess.DEVNULL,
+                   env={**os.environ, **env})
+
+def do_test_throughput(workdir, engine, args):
+    """Invocations per second of do_test.py testing the library with fake_compiler.py."""
+    report = workdir / f'report-{engine}.json'
+    env = {'FAKE_CC_DATA': 'data.yaml', 'FAKE_CC_LATENCY': str(args.latency)}
+    fake = [tools / 'bench' / 'fake_compiler.py']
+    engine_args = ['--batch'] if engine == 'batch' else ['--engine', engine]
+    command = [tools / 'do_test.py', 'gcc', 'library', '--cc', *fake, '--std', 'C++17', 'C++23', '--no-cache', '--no-db',
+               '--no-history', '-j', str(args.jobs), '--report', report.resolve(), *engine_args]
+    # The macros of each configuration are computed by the first run of the fake compiler.
+    run_tool(workdir, *fake, '-E', '-std=c++17', '-', env=env)
+    # A report left over from a previous run would pass for the result of a run that crashed.
+    report.unlink(missing_ok=True)
+    start = time.perf_counter()
+    res = subprocess.run([sys.executable, *map(str, command)], cwd=workdir, stdout=subprocess.DEVNULL, env={**os.environ, **env})
+    elapsed = time.perf_counter() - start
+    if res.returncode != 0 or not report.exists():
+        raise RuntimeError(f'do_test.py ({engine}) failed with exit code {res.returncode}')
+    invocations = sum(entry['invocations'] for entry in json.load(open(report, encoding='utf-8')))
+    return elapsed, invocations / elapsed
+
+def run_benchmarks(args):
+    results = {}
+    for scale in args.scales:
+        workdir = prepare_workdir(scale)
+        text = (workdir / 'data.yaml').read_text(encoding='utf-8')
+        db = FeatureDB(parse_data(text))
+        timings = results[f'x{scale}'] = {}
+        timings['load'] = best_of(args.repeat, lambda: FeatureDB(parse_data(text)))
+        load_data(workdir / 'data.yaml', workdir / '.cache/snapshots')
+        timings['load (snapshot)'] = best_of(args.repeat, lambda: FeatureDB(load_data(workdir / 'data.yaml', workdir / '.cache/snapshots')))
+        timings['generate'] = best_of(args.repeat, lambda: generate_all(db))
+        timings['table'] = best_of(args.repeat, lambda: [run_tool(workdir, tools / 'maketable_cppreference.py', kind, '--disable-warning', '-o', os.devnull)
+                                                         for kind in ['language', 'library']])
+        timings['version.def import'] = best_of(args.repeat, lambda: run_tool(workdir, tools / 'update_from_glibcxx_version_def.py', 'version.def', 'imported.yaml'))
+        if scale in args.e2e_scales:
+            for engine in ['testsuite', 'batch', 'dump']:
+                elapsed, throughput = do_test_throughput(workdir, engine, args)
+                timings[f'do_test {engine}'] = elapsed
+                timings[f'do_test {engine} (invocations/s)'] = throughput
+        for name, value in timings.items():
+            print(f'x{scale:<4} {name:36} {value:10.1f}' if name.endswith('/s)') else f'x{scale:<4} {name:36} {value * 1000:10.1f} ms')
+    return results
+
+def compare(results, baseline, threshold):
+    """Print the benchmarks that are slower than in the baseline by more than threshold; returns their number."""
+    regressions = 0
+    for scale, timings in results.items():
+        for name, value in timings.items():
+            old = baseline.get(scale, {}).get(name)
+            if old is None:
+                continue
+            # Throughputs regress when they drop, timings when they grow.
+            ratio = old / value if name.endswith('/s)') else value / old
+            if ratio > 1 + threshold:
+                print(f'regression: {scale} {name}: {old:.4g} -> {value:.4g} ({(ratio - 1) * 100:.0f}% worse)')
+                regressions += 1
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the tools. Run from the project root.')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1, 10, 100], help='Numbers of copies of each macro to benchmark with (default: %(default)s)')
+    parser.add_argument('--e2e-scales', type=int, nargs='*', default=[1], help='Scales at which do_test.py is run end to end (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Number of runs of which the fastest counts (default: %(default)s)')
+    parser.add_argument('--latency', type=float, default=0, help='Seconds each run of the fake compiler takes on top of its own work (default: %(default)s)')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Jobs for do_test.py (default: number of CPUs)')
+    parser.add_argument('--baseline', default='.cache/bench/baseline.json', help='Baseline file (default: %(default)s)')
+    parser.add_argument('--save', action='store_true', help='Save the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='Compare the results with the baseline, and fail on regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown relative to the baseline that counts as a regression (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args)
+    exitcode = 0
+    if args.compare:
+        baseline = json.load(open(args.baseline, encoding='utf-8'))
+        if baseline['machine'] != platform.machine() or baseline['python'] != platform.python_version():
+            print(f'warning: the baseline was taken with Python {baseline["python"]} on {baseline["machine"]}')
+        exitcode = int(compare(results, baseline['results'], args.threshold) > 0)
+    if args.save:
+        atomic_write(args.baseline, json.dumps({'python': platform.python_version(), 'machine': platform.machine(), 'results': results}, indent=1))
+    sys.exit(exitcode)
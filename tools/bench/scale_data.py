@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""Synthetic inputs for the benchmarks: data.yaml with every macro repeated, and a
+libstdc++ version.def that matches the gcc library support of such a data.yaml."""
+import argparse, copy, pathlib, sys, yaml
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from utilities import kinds, load_data, FeatureDB
+
+def scale_data(data, factor):
+    """data with factor copies of each macro; the copies get the suffixes _2, _3, ..."""
+    scaled = {}
+    for kind in kinds:
+        scaled[kind] = list(data[kind])
+        for copy_index in range(2, factor + 1):
+            for macro in data[kind]:
+                scaled[kind].append({**copy.deepcopy(macro), 'name': f"{macro['name']}_{copy_index}"})
+    return scaled
+
+def make_version_def(db):
+    out = ['AutoGen Definitions version.tpl;', '']
+    for macro in db['library']:
+        if not macro.support['gcc']:
+            continue
+        out += ['ftms = {', f"  name = {macro.name.removeprefix('__cpp_lib_')};"]
+        for item in reversed(macro.support['gcc']):
+            out.append('  values = {')
+            out.append(f'    v = {item.value};')
+            if item.since:
+                out.append(f"    cxxmin = {item.since.removeprefix('C++')};")
+            out.append('  };')
+        out += ['};', '']
+    return '\n'.join(out)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write data.yaml scaled by a factor, e.g. to benchmark the tools on a larger database.')
+    parser.add_argument('factor', type=int, help='Number of copies of each macro')
+    parser.add_argument('-i', dest='input', default='data.yaml', help='Input file (default: %(default)s)')
+    parser.add_argument('-o', dest='output', required=True, help='Output data.yaml')
+    parser.add_argument('--version-def', metavar='FILE', help='Also write a version.def with the gcc library support of the output')
+    args = parser.parse_args()
+
+    data = scale_data(load_data(args.input), args.factor)
+    # The output is only read by the tools, so the faster libyaml emitter is used if available.
+    yaml.dump(data, open(args.output, 'w', encoding='utf-8'), Dumper=getattr(yaml, 'CSafeDumper', yaml.SafeDumper), allow_unicode=True, sort_keys=False)
+    if args.version_def:
+        open(args.version_def, 'w', encoding='ascii').write(make_version_def(FeatureDB(data)))
@@ -1,9 +1,459 @@
 #!/usr/bin/env python3
-import argparse, subprocess, yaml, pathlib, sys
-from utilities import kinds, implementations, standards, library_prologue, std_options, TestsuiteGenerator
+import argparse, concurrent.futures, contextlib, functools, hashlib, heapq, json, os, re, shutil, subprocess, tempfile, threading, time, pathlib, sys, yaml
+from utilities import kinds, implementations, standards, standard_index, library_prologue, parse_data, std_options, item_conditions, parse_macro_dump, evaluate_condition, expected_value, add_selection_arguments, select_macros, atomic_write, FeatureDB, TestsuiteGenerator
+from results import ResultStore, observed_value, accepted_value
 
-def do_test(impl, kind, cc, extra_args, enabled_std, dry_run, verbose):
-    test_std_opts = [std_opt for std, std_opt in std_options(impl) if std in enabled_std]
+def compiler_identity(compiler):
+    path = shutil.which(compiler) or compiler
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    try:
+        res = subprocess.run([path, '--version'], capture_output=True, text=True)
+        version = res.stdout + res.stderr
+    except OSError:
+        version = None
+    return [os.path.realpath(path), version, mtime]
+
+class ResultCache:
+    """On-disk cache of successful compiler runs, keyed by the identity of the compiler,
+    the full command line and the source file. Least recently used entries are
+    evicted once the cache grows beyond max_size bytes."""
+
+    def __init__(self, directory, compiler, max_size=256 * 2**20):
+        self.directory = pathlib.Path(directory)
+        self.identity = compiler_identity(compiler)
+        self.max_size = max_size
+        self.hits = self.misses = 0
+        self.lock = threading.Lock()
+
+    def key(self, run, source, salt=None):
+        return hashlib.sha256(json.dumps([self.identity, run, source, *([salt] if salt else [])]).encode()).hexdigest()
+
+    def get(self, key):
+        path = self.directory / key[:2] / key
+        try:
+            entry = json.loads(path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+        os.utime(path)
+        with self.lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        atomic_write(self.directory / key[:2] / key, json.dumps(entry))
+
+    def evict(self):
+        if not self.directory.exists():
+            return
+        entries = [(entry.stat().st_mtime, entry.stat().st_size, entry) for entry in self.directory.glob('*/*')]
+        size = sum(entry_size for mtime, entry_size, entry in entries)
+        for mtime, entry_size, entry in sorted(entries, key=lambda entry: entry[0]):
+            if size <= self.max_size:
+                break
+            entry.unlink(missing_ok=True)
+            size -= entry_size
+
+line_marker = re.compile(r'^#(?:line)?\s*\d+\s+"((?:[^"\\]|\\.)*)"', re.M)
+
+def header_fingerprint(run_prefix, prologue, run_compiler):
+    """A hash of the headers that the prologue includes when preprocessed with run_prefix:
+    their paths, sizes and modification times. The results of library tests depend on these
+    headers, which a standard library update changes without touching the compiler."""
+    res = run_compiler(run_prefix, prologue, 'prologue.cpp')
+    headers = {}
+    for path in line_marker.findall(res.stdout):
+        path = path.replace('\\\\', '\\')
+        if path not in headers and path != 'prologue.cpp' and not path.startswith('<'):
+            try:
+                stat = os.stat(path)
+                headers[path] = [stat.st_size, stat.st_mtime_ns]
+            except OSError:
+                pass
+    return hashlib.sha256(json.dumps([res.returncode, headers]).encode()).hexdigest()
+
+class CompilerCapabilities:
+    """Which standard options the compiler accepts, and which other options it accepts
+    together with each standard option, as found by preprocessing an empty file. The
+    answers are kept in the cache directory per compiler identity and extra arguments,
+    so that each combination is probed once. With save=False, new answers are not kept."""
+
+    def __init__(self, directory, identity, extra_args, save=True):
+        key = hashlib.sha256(json.dumps([identity, extra_args]).encode()).hexdigest()
+        self.path = pathlib.Path(directory) / f'capabilities-{key[:16]}.json' if directory else None
+        self.save = save
+        self.accepted = {}
+        if self.path:
+            try:
+                self.accepted = json.loads(self.path.read_text(encoding='utf-8'))
+            except (OSError, ValueError):
+                pass
+
+    @staticmethod
+    def combinations(args):
+        std_opt, *rest = args
+        return [std_opt, *(f'{std_opt} {arg}' for arg in rest if not arg.startswith('-D'))]
+
+    def probe(self, combinations, run, jobs):
+        """Probe the combinations (strings of options) that have not been probed yet;
+        run(options) preprocesses an empty file with the options."""
+        missing = [combination for combination in combinations if combination not in self.accepted]
+        if not missing:
+            return
+        with concurrent.futures.ThreadPoolExecutor(jobs) as pool:
+            for combination, res in zip(missing, pool.map(lambda combination: run(combination.split()), missing)):
+                self.accepted[combination] = res.returncode == 0 and res.stderr.strip() == ''
+        if self.path and self.save:
+            atomic_write(self.path, json.dumps(self.accepted, indent=1))
+
+    def rejected(self, args):
+        """The combinations in the invocation with args that the compiler is known not to accept."""
+        return [combination for combination in self.combinations(args) if not self.accepted.get(combination, True)]
+
+class FailureHistory:
+    """The invocations that failed in recent runs, so that they can be run first. For each
+    configuration, maps macro names and command lines to the number of the run in which
+    they last failed; failures older than `keep` runs are forgotten."""
+
+    def __init__(self, path, keep=20):
+        self.path = pathlib.Path(path)
+        self.keep = keep
+        try:
+            data = json.load(open(self.path, encoding='utf-8'))
+        except (OSError, ValueError):
+            data = {'runs': 0, 'failures': {}}
+        self.run_number = data['runs'] + 1
+        self.failures = data['failures']
+
+    def priority(self, configuration, macro, args=None):
+        """The number of the last run in which the macro (with args, if given) failed; 0 if none."""
+        failures = self.failures.get(configuration, {}).get(macro, {})
+        if args is not None:
+            return failures.get(' '.join(args), 0)
+        return max(failures.values(), default=0)
+
+    def update(self, configuration, records):
+        failures = self.failures.setdefault(configuration, {})
+        for record in records:
+            commands = failures.setdefault(record['macro'], {})
+            if record['passed']:
+                commands.pop(' '.join(record['options']), None)
+            else:
+                commands[' '.join(record['options'])] = self.run_number
+
+    def save(self):
+        for configuration in self.failures.values():
+            for macro, commands in list(configuration.items()):
+                for command, run_number in list(commands.items()):
+                    if run_number <= self.run_number - self.keep:
+                        del commands[command]
+                if not commands:
+                    del configuration[macro]
+        atomic_write(self.path, json.dumps({'runs': self.run_number, 'failures': self.failures}, indent=1))
+
+# Compilers that cannot read from stdin get their input from here, which is memory-backed on most Linux systems.
+memory_tempdir = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+
+def input_args(path, input_mode):
+    return ['-x', 'c++', '-'] if input_mode == 'stdin' else [path]
+
+class Profiler:
+    """Timed spans of the phases of a run and of each compiler invocation, written in the
+    Chrome trace event format (chrome://tracing, https://ui.perfetto.dev)."""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.origin = time.perf_counter()
+        self.events = []
+        self.threads = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, category, start, duration, args={}):
+        if not self.enabled:
+            return
+        thread = threading.current_thread()
+        with self.lock:
+            self.threads[thread.ident] = thread.name
+            self.events.append({'name': name, 'cat': category, 'ph': 'X', 'ts': (start - self.origin) * 1e6, 'dur': duration * 1e6,
+                                'pid': os.getpid(), 'tid': thread.ident, 'args': args})
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, 'phase', start, time.perf_counter() - start, args)
+
+    def write(self, filename):
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(), 'tid': tid, 'args': {'name': name}} for tid, name in self.threads.items()]
+        atomic_write(filename, json.dumps({'traceEvents': metadata + self.events, 'displayTimeUnit': 'ms'}))
+
+    def summary(self, top):
+        phases = [event for event in self.events if event['cat'] == 'phase']
+        invocations = [event for event in self.events if event['cat'] in ['invocation', 'cache']]
+        print('Phases:')
+        for event in phases:
+            print(f'  {event["dur"] / 1e6:8.3f}s  {event["name"]}')
+        if not invocations:
+            return
+        # The compiler and the options common to every invocation say nothing about an option set.
+        commands = [event['args']['args'] for event in invocations]
+        common = 0
+        while all(len(command) > common and command[common] == commands[0][common] for command in commands):
+            common += 1
+        for title, key in [('macros', lambda event: event['name']), ('option sets', lambda event: ' '.join(event['args']['args'][common:]) or '(none)')]:
+            totals = {}
+            for event in invocations:
+                total = totals.setdefault(key(event), [0, 0, 0])
+                total[0] += event['dur'] / 1e6
+                total[1] += event['args']['cpu'] or 0
+                total[2] += 1
+            print(f'Slowest {title} (wall time, CPU time, invocations):')
+            for name, (wall, cpu, count) in sorted(totals.items(), key=lambda item: -item[1][0])[:top]:
+                print(f'  {wall:8.3f}s {cpu:8.3f}s {count:5}  {name}')
+
+def run_process(args, input=None, measure_cpu=False):
+    """subprocess.run(args, input=input, capture_output=True, text=True). With measure_cpu,
+    the output goes through temporary files so that the process can be reaped by os.wait4,
+    which tells the CPU time it used; that time, if known, is the cpu_time of the result."""
+    if not (measure_cpu and hasattr(os, 'wait4')):
+        res = subprocess.run(args, input=input, capture_output=True, text=True)
+        res.cpu_time = None
+        return res
+    with tempfile.TemporaryFile('w+') as stdout, tempfile.TemporaryFile('w+') as stderr:
+        proc = subprocess.Popen(args, stdin=None if input is None else subprocess.PIPE, stdout=stdout, stderr=stderr, text=True)
+        if input is not None:
+            try:
+                proc.stdin.write(input)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        pid, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        stdout.seek(0)
+        stderr.seek(0)
+        res = subprocess.CompletedProcess(args, proc.returncode, stdout.read(), stderr.read())
+    res.cpu_time = usage.ru_utime + usage.ru_stime
+    return res
+
+def run_compiler(run, source, path, strip_banner, cache=None, input_mode='file', profiler=None, salt=None):
+    """Run the compiler with the arguments `run` on `source`. In 'file' mode, the source
+    has already been written to `path`; in 'stdin' mode it is piped to the compiler, and
+    in 'memory' mode it is written to a temporary file under memory_tempdir. Either way,
+    a #line directive keeps diagnostics referring to `path`."""
+    start = time.perf_counter()
+    measure_cpu = profiler is not None and profiler.enabled
+    if cache:
+        key = cache.key([*run, path], source, salt)
+        entry = cache.get(key)
+        if entry is not None:
+            res = subprocess.CompletedProcess([*run, path], 0, entry['stdout'], entry['stderr'])
+            res.duration = time.perf_counter() - start
+            if profiler:
+                profiler.add(pathlib.Path(path).stem, 'cache', start, res.duration, {'args': run, 'file': path, 'returncode': 0, 'cpu': None})
+            return res
+    if input_mode == 'file':
+        res = run_process([*run, path], measure_cpu=measure_cpu)
+    elif input_mode == 'stdin':
+        res = run_process([*run, '-x', 'c++', '-'], f'#line 1 "{path}"\n{source}', measure_cpu)
+    else:
+        fd, temp = tempfile.mkstemp(suffix='.cpp', dir=memory_tempdir)
+        try:
+            with os.fdopen(fd, 'w', encoding='ascii') as f:
+                f.write(f'#line 1 "{path}"\n{source}')
+            res = run_process([*run, temp], measure_cpu=measure_cpu)
+        finally:
+            os.unlink(temp)
+    if strip_banner:
+        res.stderr = res.stderr[res.stderr.index('\n')+1:]
+    # Only passing runs are cached, so failures are always reported from a fresh run.
+    if cache and res.returncode == 0 and res.stderr.strip() == '':
+        cache.put(key, {'stdout': res.stdout, 'stderr': res.stderr})
+    res.duration = time.perf_counter() - start
+    if profiler:
+        profiler.add(pathlib.Path(path).stem, 'invocation', start, res.duration, {'args': run, 'file': path, 'returncode': res.returncode, 'cpu': res.cpu_time})
+    return res
+
+def split_diagnostics(stderr, testfiles):
+    """Distribute the diagnostics of a batched run over the macros, keyed by the
+    file name the #line markers gave each macro. Diagnostics issued before any
+    macro (e.g. bad options or errors in <version>) belong to every macro."""
+    prelude, per_file, current = [], {testfile: [] for testfile in testfiles}, None
+    for line in stderr.splitlines(keepends=True):
+        for testfile in testfiles:
+            if line.startswith((f'{testfile}:', f'{testfile}(')):
+                current = testfile
+                break
+        if current is None:
+            prelude.append(line)
+        else:
+            per_file[current].append(line)
+    return {testfile: ''.join(prelude + lines) for testfile, lines in per_file.items()}
+
+def run_batch(compiler_args, batch, prologue, batchfile, run_prefix, run_compiler, write_file):
+    """Preprocess every test of a configuration in one translation unit.
+
+    Compilers that treat #error as fatal stop at the first failure, so the tests
+    that did not make it into the output are run again in a new batch."""
+    results, pending = {}, batch
+    while pending:
+        source = prologue + ''.join(chunk for s, testfile, chunk in pending)
+        if write_file:
+            open(batchfile, 'w', encoding='ascii').write(source)
+        res = run_compiler([*run_prefix, *compiler_args], source, batchfile)
+        diagnostics = split_diagnostics(res.stderr, [testfile for s, testfile, chunk in pending])
+        for s, testfile, chunk in pending:
+            results[testfile] = subprocess.CompletedProcess(res.args, res.returncode, res.stdout, diagnostics[testfile])
+            results[testfile].duration = res.duration
+        done = [test for test in pending if test[0] in res.stdout]
+        if not done or len(done) == len(pending):
+            break
+        pending = [test for test in pending if test not in done]
+    return results
+
+def run_dump(run, source, dumpfile, run_compiler):
+    res = run_compiler(run, source, dumpfile)
+    return res, parse_macro_dump(res.stdout)
+
+def make_prologue_header(run_prefix, args, prologue, path, run_compiler):
+    """Write to path a header that defines the macros the prologue defines with the
+    compiler arguments args, as found from macro dumps with and without the prologue.
+    Passed with -include, it stands in for the headers of the prologue, whose include
+    guards it defines too. Returns whether the prologue could be preprocessed cleanly."""
+    dumps = []
+    for source in ['', prologue]:
+        res = run_compiler([*run_prefix, '-dM', *args], source, str(path.with_suffix('.cpp')))
+        if res.returncode != 0 or res.stderr.strip() != '':
+            return False
+        dumps.append({re.match(r'#define (\w+)', line)[1]: line for line in res.stdout.splitlines() if line.startswith('#define ')})
+    empty, full = dumps
+    lines = [f'#undef {name}' for name in empty if name not in full]
+    for name, line in full.items():
+        if empty.get(name) != line:
+            lines += [f'#undef {name}'] if name in empty else []
+            lines.append(line)
+    atomic_write(path, ''.join(line + '\n' for line in lines))
+    return True
+
+def is_dump_checkable(macro, impl):
+    try:
+        for item in macro.support[impl] or []:
+            for condition in item_conditions(item):
+                evaluate_condition(condition, {})
+        return True
+    except ValueError:
+        return False
+
+def check_dump(macro, impl, s, res, macros):
+    """Derive from the macro dump of a configuration the result that preprocessing
+    the generated test of the macro would have given."""
+    name = macro.name
+    stdout, stderr, returncode = '', res.stderr, res.returncode
+    if returncode == 0:
+        stdout = f'{s}{macros.get(name, name)}\n'
+        expected = expected_value(macro, impl, macros)
+        if expected is None and name in macros:
+            stderr += f'error: {name} is defined\n'
+            returncode = 1
+        elif expected is not None and evaluate_condition(name, macros) != expected:
+            stderr += f'error: {name} is not equal to {expected}\n'
+            returncode = 1
+    result = subprocess.CompletedProcess(res.args, returncode, stdout, stderr)
+    result.duration = res.duration
+    return result
+
+def changed_macros(db, ref, kind, impl):
+    """Names of the macros of the given kind that were added since the git revision ref,
+    or whose rows or support data for impl were changed."""
+    res = subprocess.run(['git', 'show', f'{ref}:data.yaml'], capture_output=True, text=True, encoding='utf-8')
+    if res.returncode != 0:
+        parser.error(f'--changed-since: cannot read data.yaml at {ref}: {res.stderr.strip()}')
+    old_db = FeatureDB(parse_data(res.stdout, [kind]))
+    changed = set()
+    for macro in db[kind]:
+        old = old_db.macro(macro.name)
+        if old is None or old.rows != macro.rows or old.support[impl] != macro.support[impl]:
+            changed.add(macro.name)
+    return changed
+
+def relevant_std_options(macro, impl, test_std_opts):
+    """The (std, std_opt) pairs of test_std_opts that can tell apart the support entries of
+    the macro: the lowest and highest standard, and the ones on either side of each `since`.
+    The expected value cannot change between other standards, except when it depends on
+    other macros, which may have their own thresholds; such macros get every standard."""
+    items = macro.support[impl] or []
+    if any(item.depends is not None for item in items):
+        return test_std_opts
+    keep = {0, len(test_std_opts) - 1}
+    for item in items:
+        if item.since is not None:
+            above = next((index for index, (std, std_opt) in enumerate(test_std_opts)
+                          if standard_index[std] >= standard_index[item.since]), len(test_std_opts))
+            keep |= {above - 1, above}
+    return [pair for index, pair in enumerate(test_std_opts) if index in keep]
+
+def make_compiler_args(generator, macro, test_std_opts, exhaustive=True):
+    """The options of each invocation testing the macro. Unless exhaustive, only the
+    relevant standards are tested, and each distinct command line only once."""
+    if not exhaustive:
+        test_std_opts = relevant_std_options(macro, generator.impl, test_std_opts)
+    compiler_args = []
+    for std, std_opt in test_std_opts:
+        for opts in generator.make_options(macro):
+            pedantic = generator.pedantic_options(macro) or [None]
+            for ped_opt in pedantic:
+                compiler_args.append([std_opt] + ([ped_opt] if ped_opt else []) + opts)
+    if not exhaustive:
+        compiler_args = list({tuple(args): args for args in compiler_args}.values())
+    return compiler_args
+
+def select_shard(macros, costs, index, count):
+    """Split the macros into `count` shards of about equal total cost, and return the
+    1-based shard `index`. Macros are handed out most expensive first, each to the
+    currently cheapest shard, with ties broken by name and shard number, so every
+    node computes the same partition."""
+    shards = [(0, number) for number in range(count)]
+    assigned = {}
+    for macro in sorted(macros, key=lambda macro: (-costs[macro.name], macro.name)):
+        cost, number = heapq.heappop(shards)
+        assigned[macro.name] = number
+        heapq.heappush(shards, (cost + costs[macro.name], number))
+    return [macro for macro in macros if assigned[macro.name] == index - 1]
+
+def merge_reports(filenames):
+    reports = [report for filename in filenames for report in json.load(open(filename, encoding='utf-8'))]
+    exitcode = 0
+    for report in reports:
+        for failure in report['failures']:
+            print(failure['diagnostics'])
+            print('compiler options: ', failure['options'])
+            if failure['value'] is not None:
+                print(failure['value'])
+        exitcode = exitcode or report['exitcode']
+    for impl, kind in sorted({(report['impl'], report['kind']) for report in reports}):
+        shards = [report for report in reports if (report['impl'], report['kind']) == (impl, kind)]
+        counts = {report['shard'][1] for report in shards if report['shard']}
+        present = [tuple(report['shard']) for report in shards if report['shard']]
+        # A merged result that lacks a shard, or counts one twice, says nothing about the whole.
+        for count in sorted(counts):
+            missing = [str(index) for index in range(1, count + 1) if (index, count) not in present]
+            if missing:
+                print(f'error: {impl} {kind}: missing report for shard {", ".join(missing)} of {count}')
+                exitcode = exitcode or 1
+            duplicated = [str(index) for index in range(1, count + 1) if present.count((index, count)) > 1]
+            if duplicated:
+                print(f'error: {impl} {kind}: more than one report for shard {", ".join(duplicated)} of {count}')
+                exitcode = exitcode or 1
+        print(f'{impl} {kind}: {len(shards)} report(s), {sum(len(report["tested"]) for report in shards)} macros tested,',
+              f'{sum(report["invocations"] for report in shards)} invocations, {sum(len(report["failures"]) for report in shards)} with diagnostics')
+    return exitcode
+
+def default_compiler(impl, cc):
     compiler, diag_opt = cc, []
     if cc == None:
         if impl == 'clang':
@@ -12,81 +462,499 @@ def do_test(impl, kind, cc, extra_args, enabled_std, dry_run, verbose):
             compiler, diag_opt = 'gcc', ['-fno-diagnostics-show-caret', '-ftrack-macro-expansion=0']
         elif impl == 'msvc':
             compiler, diag_opt = 'cl.exe', ['-nologo', '-Zc:__cplusplus']
+    return compiler, diag_opt
 
-    if dry_run:
-        print('Dry run...')
+class TestRun:
+    """Tests the macros of one kind with one implementation and compiler. Tests are
+    planned by prepare(), handed to a shared pool by submit(), and their results
+    are printed, in a stable order, by report()."""
 
-    a = yaml.safe_load(open('data.yaml', encoding='utf-8'))
-    assert list(a.keys()) == kinds
+    def __init__(self, db, impl, kind, cc, extra_args, enabled_std, options, caches, profiler, history=None, subdir=''):
+        self.db, self.impl, self.kind, self.cc, self.extra_args, self.options = db, impl, kind, cc, extra_args, options
+        self.test_std_opts = [(std, std_opt) for std, std_opt in std_options(impl) if std in enabled_std]
+        self.std_of = {std_opt: std for std, std_opt in std_options(impl)}
+        self.compiler, self.diag_opt = default_compiler(impl, cc)
+        self.input_mode = 'file'
+        if options.stdin:
+            # cl.exe and clang-cl cannot read the source from stdin.
+            self.input_mode = 'memory' if impl == 'msvc' else 'stdin'
+        self.cache = None
+        if options.cache_dir and not options.dry_run:
+            self.cache = caches.setdefault(self.compiler, ResultCache(options.cache_dir, self.compiler))
+        self.run = functools.partial(run_compiler, strip_banner=cc == None and impl == 'msvc', cache=self.cache, input_mode=self.input_mode, profiler=profiler)
+        self.profiler = profiler
+        self.run_uncached = functools.partial(run_compiler, strip_banner=cc == None and impl == 'msvc', input_mode='memory', profiler=profiler)
+        self.capabilities = None
+        self.fingerprint = None
+        self.unsupported = {}
+        self.probe_error = None
+        self.prologue_headers = {}
+        self.prologue_tempdir = None
+        self.testdir = pathlib.Path('test/individuals') / subdir
+        self.batchdir = pathlib.Path('test/batches') / subdir
+        self.dumpfile = pathlib.Path('test/dumps') / f'{kind}.cpp'
+        self.prologue = library_prologue if kind == 'library' else ''
+        self.tests, self.batches, self.dumps = [], {}, {}
+        self.failures = []
+        self.records = []
+        self.history = history
+        self.skipped = 0
+        self.exitcode = None
 
-    testbasedir = pathlib.Path('test/individuals')
-    if dry_run:
-        print('Would create directory', testbasedir)
-    else:
-        testbasedir.mkdir(parents=True, exist_ok=True)
+    def describe(self):
+        return ' '.join([self.impl, self.kind, f'(cc: {self.compiler})', *self.extra_args])
 
-    exitcode = 0
+    def configuration(self):
+        return ' '.join([self.impl, self.kind, self.compiler, *self.extra_args])
+
+    def prepare(self, sources):
+        impl, kind, options = self.impl, self.kind, self.options
+        dry_run, input_mode = options.dry_run, self.input_mode
+        compiler, diag_opt, extra_args, prologue = self.compiler, self.diag_opt, self.extra_args, self.prologue
+
+        if input_mode == 'memory':
+            print(f'{compiler} cannot read from stdin, passing sources through temporary files in {memory_tempdir or tempfile.gettempdir()}')
+
+        # Macro dumps cannot tell the value of __has_cpp_attribute, and cl.exe cannot produce them.
+        use_dump = options.engine == 'dump' and kind != 'attributes' and impl != 'msvc'
+        if options.engine == 'dump' and not use_dump:
+            print(f'Macro dumps are not supported for {impl} {kind}, falling back to generated tests')
+
+        testbasedir = self.batchdir if options.batch else self.testdir
+        for directory in ([testbasedir, self.dumpfile.parent] if use_dump else [testbasedir]) if input_mode == 'file' else []:
+            if dry_run:
+                print('Would create directory', directory)
+            else:
+                directory.mkdir(parents=True, exist_ok=True)
+
+        macros = select_macros(self.db[kind], options)
+        if options.changed_since:
+            changed = changed_macros(self.db, options.changed_since, kind, impl)
+            print(f'Skipping macros unchanged since {options.changed_since}:', *[macro.name for macro in macros if macro.name not in changed])
+            macros = [macro for macro in macros if macro.name in changed]
+        test_std_opts = self.test_std_opts
+        if options.probe:
+            # Probing only preprocesses an empty file, so a dry run prunes what a real run would.
+            try:
+                test_std_opts = self.probe(macros)
+            except OSError as e:
+                if not dry_run:
+                    raise
+                print(f'Cannot probe {compiler} ({e.strerror}), the invocations below are unverified: a real run skips those it does not accept')
+        # cl.exe cannot dump macros, and dumps and batches process the prologue once anyway.
+        use_pch = options.pch and prologue and impl != 'msvc' and not options.batch and not dry_run
+        if prologue and (self.cache or use_pch):
+            # Cached library results and preprocessed prologues are only valid with the headers they were produced with.
+            with self.profiler.span(f'fingerprint headers {compiler}'):
+                self.fingerprint = header_fingerprint([compiler, '-E', *diag_opt, *extra_args], prologue, self.run_uncached)
+        if self.cache and self.fingerprint:
+            self.run = functools.partial(self.run, salt=self.fingerprint)
+        if options.shard:
+            costs = {macro.name: len(make_compiler_args(TestsuiteGenerator(kind, impl), macro, test_std_opts, options.exhaustive)) for macro in macros}
+            macros = select_shard(macros, costs, *options.shard)
+            print(f'Testing shard {options.shard[0]}/{options.shard[1]}: {len(macros)} macros, {sum(costs[macro.name] for macro in macros)} invocations')
+        if self.history:
+            # Whatever failed most recently runs, and is reported, first.
+            macros = sorted(macros, key=lambda macro: -self.history.priority(self.configuration(), macro.name))
+        skipped = 0
+        for macro in macros:
+            generator = TestsuiteGenerator(kind, impl)
 
-    for macro in a[kind]:
-        generator = TestsuiteGenerator(kind, impl)
-        output = library_prologue if kind == 'library' else ''
+            s = f'"{macro.name}": '
+            testfile = str(self.testdir / f'{macro.name}.cpp')
+            # Runs that share the implementation and kind share the generated sources too.
+            shared = testfile in sources
+            if not shared:
+                output = f'\n{s}{generator.test_expr(macro.name)}\n'
+                generator.generate_test_item(macro)
+                sources[testfile] = output + generator.output
+            output = sources[testfile]
 
-        s = f'"{macro["name"]}": '
-        output += f'\n{s}{generator.test_expr(macro["name"])}\n'
+            compiler_args = make_compiler_args(generator, macro, test_std_opts, options.exhaustive)
+            skipped += len(make_compiler_args(generator, macro, test_std_opts)) - len(compiler_args)
+            if self.capabilities:
+                for std, std_opt in self.test_std_opts:
+                    if (std, std_opt) not in test_std_opts:
+                        self.unsupported[std_opt] = self.unsupported.get(std_opt, 0) + len(make_compiler_args(generator, macro, [(std, std_opt)]))
+                for args in compiler_args:
+                    for combination in self.capabilities.rejected(args)[:1]:
+                        self.unsupported[combination] = self.unsupported.get(combination, 0) + 1
+                compiler_args = [args for args in compiler_args if not self.capabilities.rejected(args)]
+            if self.history:
+                compiler_args.sort(key=lambda args: -self.history.priority(self.configuration(), macro.name, args))
 
-        generator.generate_test_item(macro)
-        output += generator.output
+            dumped = use_dump and is_dump_checkable(macro, impl)
+            if dumped:
+                for args in compiler_args:
+                    self.dumps.setdefault(tuple(args), len(self.dumps))
+            elif options.batch:
+                # Line markers keep diagnostics pointing at the lines of the per-macro test file.
+                chunk = f'#line {prologue.count(chr(10)) + 1} "{testfile}"\n{output}'
+                for args in compiler_args:
+                    self.batches.setdefault(tuple(args), []).append((s, testfile, chunk))
+            elif dry_run:
+                if input_mode == 'file' and not shared:
+                    print('Would create', testfile)
+                for args in compiler_args:
+                    print('+', compiler, '-E', *diag_opt, *extra_args, *args, *input_args(testfile, input_mode))
+            elif input_mode == 'file' and not shared:
+                open(testfile, 'w', encoding='ascii').write(prologue + output)
+            self.tests.append((macro, s, testfile, prologue + output, compiler_args, dumped))
 
-        testfile = str(testbasedir / f'{macro["name"]}.cpp')
+        if skipped:
+            print(f'Skipping {skipped} invocations that repeat a standard or command line of the same macro (use --exhaustive to run them)')
+        if self.unsupported:
+            print(f'Skipping {sum(self.unsupported.values())} invocations with options {compiler} does not accept (use --no-probe to run them):')
+            for combination, count in self.unsupported.items():
+                print(f'  {combination}: {count}')
+        if self.capabilities and not self.probe_error and macros and not any(compiler_args for *_, compiler_args, dumped in self.tests):
+            self.probe_error = {'macro': None, 'options': [], 'diagnostics': f'error: {compiler} accepts none of the invocations testing {len(macros)} macros',
+                                'value': None, 'returncode': 1}
+        if use_pch:
+            self.prepare_prologue_headers()
         if dry_run:
-            print('Would create', testfile)
+            if self.probe_error:
+                print(self.probe_error['diagnostics'])
+            if self.dumps and input_mode == 'file':
+                print('Would create', self.dumpfile)
+            for args in self.dumps:
+                print('+', compiler, '-E', '-dM', *diag_opt, *extra_args, *args, *input_args(str(self.dumpfile), input_mode))
+            for index, args in enumerate(self.batches):
+                batchfile = str(self.batchdir / f'{index}.cpp')
+                if input_mode == 'file':
+                    print('Would create', batchfile, f'({len(self.batches[args])} tests)')
+                print('+', compiler, '-E', *diag_opt, *extra_args, *args, *input_args(batchfile, input_mode))
+        elif self.dumps and input_mode == 'file':
+            open(self.dumpfile, 'w', encoding='ascii').write(prologue)
+
+    def probe(self, macros):
+        """Find out which standard options the compiler accepts, and which of the options of
+        the macros it accepts with each of them; returns the accepted (std, std_opt) pairs.
+        The options of data.yaml and -pedantic may be unknown to a compiler, but a compiler
+        that accepts no standard option at all is most likely misconfigured, which is an error."""
+        compiler, diag_opt, extra_args = self.compiler, self.diag_opt, self.extra_args
+        identity = self.cache.identity if self.cache else compiler_identity(compiler)
+        self.capabilities = CompilerCapabilities(self.options.cache_dir, identity, extra_args, save=not self.options.dry_run)
+        run = lambda opts: self.run_uncached([compiler, '-E', *diag_opt, *extra_args, *opts], '', 'probe.cpp')
+        generator = TestsuiteGenerator(self.kind, self.impl)
+        flags = {flag for macro in macros for opts in generator.make_options(macro) for flag in opts[:1]}
+        flags |= {flag for macro in macros for flag in (generator.pedantic_options(macro) or [])[:1]}
+        with self.profiler.span(f'probe {compiler}'):
+            self.capabilities.probe([std_opt for std, std_opt in self.test_std_opts], run, self.options.jobs)
+            test_std_opts = [(std, std_opt) for std, std_opt in self.test_std_opts if not self.capabilities.rejected([std_opt])]
+            self.capabilities.probe([f'{std_opt} {flag}' for std, std_opt in test_std_opts for flag in sorted(flags)], run, self.options.jobs)
+        if self.test_std_opts and not test_std_opts:
+            std_opt = self.test_std_opts[0][1]
+            self.probe_error = {'macro': None, 'options': [std_opt], 'value': None, 'returncode': 1,
+                                'diagnostics': f'error: {" ".join([compiler, *extra_args])} accepts none of the standard options'
+                                               f' {" ".join(std_opt for std, std_opt in self.test_std_opts)}; with {std_opt}, it says:\n{run([std_opt]).stderr.strip()}'}
+        return test_std_opts
+
+    def prepare_prologue_headers(self):
+        """Preprocess the prologue once per command line of the individual runs, see make_prologue_header.
+        The headers are keyed by the fingerprint of the headers the prologue includes, so they are made
+        again when those change."""
+        compiler, diag_opt, extra_args = self.compiler, self.diag_opt, self.extra_args
+        identity = self.cache.identity if self.cache else compiler_identity(compiler)
+        if self.options.cache_dir:
+            directory = pathlib.Path(self.options.cache_dir) / 'prologues'
+        elif self.input_mode == 'file':
+            directory = pathlib.Path('test/prologues')
         else:
-            open(testfile, 'w', encoding='ascii').write(output)
-
-        compiler_args = []
-        for std_opt in test_std_opts:
-            for opts in generator.make_options(macro):
-                pedantic = generator.pedantic_options(macro) or [None]
-                for ped_opt in pedantic:
-                    if cc == None and impl == 'gcc' and std_opt != '-std=c++26' and '-freflection' in opts:
-                        pass
-                    else:
-                        compiler_args.append([std_opt] + ([ped_opt] if ped_opt else []) + opts)
-
-        for args in compiler_args:
-            run = [compiler, '-E', *diag_opt, *extra_args, *args, testfile]
-            if dry_run or verbose:
-                print('+', *run)
-            if not dry_run:
-                res = subprocess.run(run, capture_output=True, text=True)
+            # --stdin writes nothing under test/; the directory is removed when the run is done.
+            self.prologue_tempdir = tempfile.TemporaryDirectory(prefix='prologues-', dir=memory_tempdir)
+            directory = pathlib.Path(self.prologue_tempdir.name)
+        for macro, s, testfile, source, compiler_args, dumped in self.tests:
+            for args in compiler_args if not dumped else []:
+                key = hashlib.sha256(json.dumps([identity, compiler, diag_opt, extra_args, args, self.prologue, self.fingerprint]).encode()).hexdigest()
+                self.prologue_headers[tuple(args)] = directory / f'{key[:16]}.h'
+        if not self.prologue_headers:
+            return
+        missing = {}
+        for args, path in self.prologue_headers.items():
+            # The headers live in the cache directory, whose least recently used entries are evicted.
+            try:
+                os.utime(path)
+            except OSError:
+                missing[args] = path
+        with self.profiler.span(f'prologue headers {compiler}'), concurrent.futures.ThreadPoolExecutor(self.options.jobs) as pool:
+            built = pool.map(lambda item: make_prologue_header([compiler, '-E', *diag_opt, *extra_args], list(item[0]), self.prologue, item[1], self.run_uncached),
+                             missing.items())
+            failed = [args for args, ok in zip(list(missing), built) if not ok]
+        for args in failed:
+            del self.prologue_headers[args]
+        print(f'Using a preprocessed prologue for {len(self.prologue_headers)} command lines ({len(missing) - len(failed)} newly made)')
+        if failed:
+            print(f'The prologue could not be preprocessed cleanly for {len(failed)} command lines, whose tests include it as usual')
+
+    def include_prologue(self, args):
+        header = self.prologue_headers.get(tuple(args))
+        return ['-include', str(header)] if header else []
+
+    def submit(self, pool):
+        compiler, diag_opt, extra_args, prologue, run = self.compiler, self.diag_opt, self.extra_args, self.prologue, self.run
+        self.dump_futures = {args: pool.submit(run_dump, [compiler, '-E', '-dM', *diag_opt, *extra_args, *args], prologue, str(self.dumpfile), run)
+                        for args in self.dumps}
+        self.batch_futures = {args: pool.submit(run_batch, list(args), batch, prologue, str(self.batchdir / f'{index}.cpp'),
+                                           [compiler, '-E', *diag_opt, *extra_args], run, self.input_mode == 'file')
+                         for index, (args, batch) in enumerate(self.batches.items())}
+        self.futures = {(testfile, tuple(args)): pool.submit(run, [compiler, '-E', *diag_opt, *extra_args, *self.include_prologue(args), *args], source, testfile)
+                        for macro, s, testfile, source, compiler_args, dumped in self.tests
+                        if not dumped and not self.options.batch for args in compiler_args}
+
+    def result(self, macro, s, testfile, args, dumped):
+        if dumped:
+            return check_dump(macro, self.impl, s, *self.dump_futures[tuple(args)].result())
+        elif self.options.batch:
+            return self.batch_futures[tuple(args)].result()[testfile]
+        return self.futures[testfile, tuple(args)].result()
+
+    def report(self, max_failures=None):
+        """Print the results; stop after max_failures failures, if given."""
+        exitcode = 0
+        max_per_macro = self.options.max_failures_per_macro
+        if self.probe_error:
+            print(self.probe_error['diagnostics'])
+            self.failures.append(self.probe_error)
+            exitcode = 1
+
+        # Results are consumed in submission order, so the report stays grouped per macro
+        # no matter which invocation finishes first.
+        for macro, s, testfile, source, compiler_args, dumped in self.tests:
+            macro_failures = 0
+            for args in compiler_args:
+                if max_failures is not None and len(self.failures) >= max_failures:
+                    self.exitcode = exitcode
+                    return exitcode
+                if max_per_macro is not None and macro_failures >= max_per_macro:
+                    # Dumps and batches are shared with other macros, so only individual runs are cancelled.
+                    future = self.futures.get((testfile, tuple(args)))
+                    if future:
+                        future.cancel()
+                    self.skipped += 1
+                    continue
+                res = self.result(macro, s, testfile, args, dumped)
+                if self.options.verbose:
+                    print('+', *res.args)
                 stderr = res.stderr
-                if cc == None and impl == 'msvc':
-                    stderr = stderr[stderr.index('\n')+1:]
+                observed = observed_value(res.stdout, s)
+                self.records.append({'macro': macro.name, 'std': next((self.std_of[arg] for arg in args if arg in self.std_of), None),
+                                     'options': args, 'expected': accepted_value(res, observed), 'observed': observed,
+                                     'passed': stderr.strip() == '', 'duration': res.duration})
                 if stderr.strip() != '':
                     print(stderr.strip())
                     print('compiler options: ', args)
-                    stdout = res.stdout
+                    stdout, value = res.stdout, None
                     if s in stdout:
                         line = stdout.index(s)
-                        print(stdout[line:stdout.index('\n', line)])
+                        value = stdout[line:].split('\n', 1)[0]
+                        print(value)
+                    self.failures.append({'macro': macro.name, 'options': args, 'diagnostics': stderr.strip(),
+                                          'value': value, 'returncode': res.returncode})
+                    macro_failures += 1
                 exitcode = exitcode or res.returncode
+        self.exitcode = exitcode
+        return exitcode
+
+    def summary(self):
+        return {'impl': self.impl, 'kind': self.kind, 'compiler': self.compiler, 'extra_args': self.extra_args,
+                'shard': self.options.shard, 'exitcode': self.exitcode,
+                'tested': [macro.name for macro, *_ in self.tests],
+                'invocations': sum(len(compiler_args) for macro, s, testfile, source, compiler_args, dumped in self.tests),
+                'unsupported': self.unsupported, 'failures': self.failures}
+
+def load_matrix(filename):
+    """Read the entries of a test matrix: a YAML list of mappings with the keys impl
+    and kind, and optionally cc, extra-args (environment variables are expanded) and std."""
+    try:
+        matrix = parse_data(open(filename, encoding='utf-8').read())
+    except yaml.YAMLError as e:
+        raise ValueError(f'{filename}: {e}') from None
+    if not isinstance(matrix, list):
+        raise ValueError(f'{filename}: expected a list of entries')
+    entries = []
+    for index, entry in enumerate(matrix, 1):
+        def check(condition, message):
+            if not condition:
+                raise ValueError(f'{filename}: entry {index} ({entry}): {message}')
+        check(isinstance(entry, dict), 'expected a mapping')
+        unknown = set(entry) - {'impl', 'kind', 'cc', 'extra-args', 'std'}
+        check(not unknown, f'unknown keys {", ".join(sorted(unknown))}')
+        check(isinstance(entry.get('cc', ''), str), 'cc must be a string')
+        check(entry.get('impl') in implementations, f'impl must be one of {", ".join(implementations)}')
+        check(entry.get('kind') in kinds, f'kind must be one of {", ".join(kinds)}')
+        check(isinstance(entry.get('std', []), list) and all(std in standards for std in entry.get('std', [])),
+              f'std must be a list of {", ".join(standards)}')
+        extra_args = entry.get('extra-args', [])
+        if isinstance(extra_args, str):
+            extra_args = extra_args.split()
+        check(isinstance(extra_args, list) and all(isinstance(arg, str) for arg in extra_args), 'extra-args must be a string or a list of strings')
+        entries.append((entry['impl'], entry['kind'], entry.get('cc'), [os.path.expandvars(arg) for arg in extra_args],
+                        entry.get('std', standards)))
+    return entries
+
+def do_test(entries, options):
+    """Test each (impl, kind, cc, extra_args, enabled_std) entry, sharing one pool of
+    workers between all of them."""
+    if options.dry_run:
+        print('Dry run...')
+
+    profiler = Profiler(bool(options.profile))
+    history = FailureHistory(options.history) if options.history else None
+    with profiler.span('load data.yaml'):
+        db = FeatureDB.load(sections=[kind for kind in kinds if kind in {entry[1] for entry in entries}])
+    matrix = len(entries) > 1
+    caches = {}
+    sources = {}
+    runs = []
+    for index, (impl, kind, cc, extra_args, enabled_std) in enumerate(entries):
+        run = TestRun(db, impl, kind, cc, extra_args, enabled_std, options, caches, profiler, history, subdir=impl if matrix else '')
+        if matrix:
+            run.batchdir /= str(index)
+            print(f'=== {run.describe()}')
+        with profiler.span(f'prepare {run.describe()}'):
+            run.prepare(sources)
+        runs.append(run)
+
+    if options.dry_run:
+        return 0
+
+    exitcode = 0
+    failures = 0
+    with profiler.span('run'), concurrent.futures.ThreadPoolExecutor(options.jobs) as pool:
+        for run in runs:
+            run.submit(pool)
+        for run in runs:
+            if matrix:
+                print(f'=== {run.describe()}')
+            with profiler.span(f'report {run.describe()}'):
+                result = run.report(None if options.max_failures is None else options.max_failures - failures)
+            exitcode = exitcode or result
+            failures += len(run.failures)
+            if options.max_failures is not None and failures >= options.max_failures:
+                print(f'Stopping after {failures} failures (--max-failures {options.max_failures})')
+                pool.shutdown(cancel_futures=True)
+                break
+    # Runs that --max-failures stopped before are left out of the summaries.
+    runs = [run for run in runs if run.exitcode is not None]
+    skipped = sum(run.skipped for run in runs)
+    if skipped:
+        print(f'Skipped {skipped} invocations of macros that already had {options.max_failures_per_macro} failures (--max-failures-per-macro)')
+
+    if matrix:
+        print('Summary:')
+        for run in runs:
+            summary = run.summary()
+            print(f'  {run.describe()}: {summary["invocations"]} invocations, {len(summary["failures"])} with diagnostics, exit code {run.exitcode}')
+    if options.db:
+        with profiler.span('record results'):
+            store = ResultStore(options.db)
+            identities = {}
+            for run in runs:
+                if run.compiler not in identities:
+                    identities[run.compiler] = run.cache.identity if run.cache else compiler_identity(run.compiler)
+                identity = identities[run.compiler]
+                store.record({'compiler': run.compiler, 'compiler_id': hashlib.sha256(json.dumps(identity).encode()).hexdigest()[:16],
+                              'compiler_version': (identity[1] or '').split('\n', 1)[0], 'impl': run.impl, 'kind': run.kind,
+                              'extra_args': run.extra_args, 'exitcode': run.exitcode}, run.records)
+    if caches:
+        hits = sum(cache.hits for cache in caches.values())
+        print(f'{hits} of {hits + sum(cache.misses for cache in caches.values())} compiler runs taken from the cache')
+        for cache in caches.values():
+            cache.evict()
+    if history:
+        for run in runs:
+            history.update(run.configuration(), run.records)
+        history.save()
+    if options.profile:
+        profiler.write(options.profile)
+        print(f'Profile written to {options.profile}')
+        profiler.summary(options.profile_top)
+    if options.report:
+        atomic_write(options.report, json.dumps([run.summary() for run in runs], indent=1))
     return exitcode
 
 standards = [std for std, __cplusplus in standards]
 
 parser = argparse.ArgumentParser()
-parser.add_argument('args', nargs='*', choices=[*implementations, *kinds], help='Implementation and kind of feature-test macros to test')
+# Not using choices, so that --merge can be used without positional arguments.
+parser.add_argument('args', nargs='*', metavar='{' + ','.join([*implementations, *kinds]) + '}', help='Implementation and kind of feature-test macros to test')
 parser.add_argument('--cc', help='''Path that identifies the compiler executable.
                                     This defaults to the name of implementation to test, but the default is likely wrong,
                                     especially when testing library feature-test macros.''')
 parser.add_argument('--extra-args', nargs=argparse.REMAINDER, help='Extra arguments to the compiler.')
 parser.add_argument('--std', nargs='+', choices=standards, default=standards, help='Standards to test.')
-parser.add_argument('-n', '--dry-run', action='store_true', help='Show how the compiler is invoked, without actually invoking')
+parser.add_argument('-n', '--dry-run', action='store_true', help='''Show how the compiler is invoked, without actually invoking it
+                                                                   (other than to probe the options it accepts, see --no-probe)''')
 parser.add_argument('--verbose', action='store_true', help='Show how the compiler is invoked before invoking')
+parser.add_argument('--batch', action='store_true', help='Preprocess all tests that share the same compiler options in a single invocation')
+parser.add_argument('--engine', choices=['testsuite', 'dump'], default='testsuite',
+                    help='''How macro values are checked: preprocess a generated test per macro (testsuite), or
+                            compare one macro dump (-dM -E) per configuration with the values data.yaml expects (dump).
+                            Tests that cannot be checked from a dump fall back to the testsuite engine.''')
+parser.add_argument('--exhaustive', action='store_true', help='''Test every combination of standard and options. By default, standards between which
+                                                             no support entry of a macro changes are skipped, and so are duplicate command lines''')
+parser.add_argument('--no-probe', dest='probe', action='store_false', help='''Run every invocation. By default, the standards and options that the compiler
+                                                                      does not accept are found out once per compiler and skipped''')
+parser.add_argument('--pch', action='store_true', help='''Preprocess the prologue of library tests (#include <version>) once per command line into a header
+                                                       of the macros it defines, and have each test include that instead''')
+parser.add_argument('--fail-fast', action='store_true', help='Stop after the first failure (same as --max-failures 1)')
+parser.add_argument('--max-failures', metavar='N', type=int, help='Stop after N failures')
+parser.add_argument('--max-failures-per-macro', metavar='N', type=int, help='Skip the remaining invocations testing a macro after N of them failed')
+parser.add_argument('--history', default='.cache/history.json', help='''File that remembers recent failures, so that they are tested and reported first
+                                                                  (default: %(default)s)''')
+parser.add_argument('--no-history', action='store_true', help='Test in the order of data.yaml, neither reading nor updating the history')
+parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='Number of compiler invocations to run in parallel (default: number of CPUs)')
+parser.add_argument('--cache-dir', default='.cache/do_test', help='Directory of the cache of passing compiler runs (default: %(default)s)')
+parser.add_argument('--no-cache', action='store_true', help='Always invoke the compiler, neither reading nor updating the cache')
+parser.add_argument('--changed-since', metavar='REF', help='Only test macros that were added or changed in data.yaml since the given git revision')
+parser.add_argument('--stdin', action='store_true', help='''Pass the generated sources to the compiler through stdin instead of writing them under test/.
+                                                          Compilers that cannot read from stdin get a temporary file in memory-backed storage.''')
+parser.add_argument('--shard', metavar='INDEX/COUNT', type=lambda arg: tuple(map(int, arg.split('/'))),
+                    help='Only test the INDEX-th (1-based) of COUNT deterministic partitions of the macros, balanced by number of invocations')
+parser.add_argument('--report', metavar='FILE', help='Write a JSON report of the run, e.g. to be combined with --merge')
+parser.add_argument('--db', default='.cache/results.sqlite', help='SQLite database the observed values are recorded in, see tools/results.py (default: %(default)s)')
+parser.add_argument('--no-db', action='store_true', help='Do not record the observed values')
+parser.add_argument('--profile', metavar='FILE', help='Write a timeline of the phases and compiler invocations in the Chrome trace event format, and summarize the slowest ones')
+parser.add_argument('--profile-top', metavar='N', type=int, default=10, help='Number of macros and option sets in the summary of --profile (default: %(default)s)')
+parser.add_argument('--matrix', metavar='FILE', help='''Test every (impl, kind, cc, extra-args, std) entry listed in a YAML file, e.g. tools/matrix.yaml,
+                                                      with one pool of workers and one consolidated report''')
+add_selection_arguments(parser)
+parser.add_argument('--merge', nargs='+', metavar='REPORT', help='Print the combined result of the given reports and exit with their merged exit code')
 args = parser.parse_args()
-[impl] = [arg for arg in args.args if arg in implementations]
-[kind] = [arg for arg in args.args if arg in kinds]
+if args.merge:
+    sys.exit(merge_reports(args.merge))
+for arg in args.args:
+    if arg not in [*implementations, *kinds]:
+        parser.error(f'argument args: invalid choice: {arg!r} (choose from {", ".join(map(repr, [*implementations, *kinds]))})')
+if args.shard and not (len(args.shard) == 2 and 1 <= args.shard[0] <= args.shard[1]):
+    parser.error('--shard must be INDEX/COUNT with 1 <= INDEX <= COUNT')
+if args.jobs < 1:
+    parser.error('--jobs must be at least 1')
+if args.fail_fast:
+    if args.max_failures is not None:
+        parser.error('--fail-fast and --max-failures cannot be used together')
+    args.max_failures = 1
+for option, value in [('--max-failures', args.max_failures), ('--max-failures-per-macro', args.max_failures_per_macro)]:
+    if value is not None and value < 1:
+        parser.error(f'{option} must be at least 1')
+if args.no_cache:
+    args.cache_dir = None
+if args.no_db:
+    args.db = None
+if args.no_history:
+    args.history = None
+
+if args.matrix:
+    try:
+        entries = load_matrix(args.matrix)
+    except (OSError, ValueError) as e:
+        parser.error(f'--matrix: {e}')
+else:
+    [impl] = [arg for arg in args.args if arg in implementations]
+    [kind] = [arg for arg in args.args if arg in kinds]
+    entries = [(impl, kind, args.cc, args.extra_args or [], args.std)]
 
-exitcode = do_test(impl, kind, args.cc, args.extra_args or [], args.std, args.dry_run, args.verbose)
+exitcode = do_test(entries, args)
 sys.exit(exitcode)
 
@@ -1,25 +1,17 @@
 #!/usr/bin/env python3
-import yaml, pathlib
-from utilities import kinds, implementations, standards, library_prologue, std_options, TestsuiteGenerator
+import argparse, concurrent.futures, pathlib
+from utilities import kinds, implementations, standards, library_prologue, std_options, add_selection_arguments, select_macros, FeatureDB, TestsuiteGenerator
 
-a = yaml.safe_load(open('data.yaml', encoding='utf-8'))
-assert list(a.keys()) == kinds
+def generate_testfile(path, kind, impl, selection=None):
+    db = FeatureDB.load(path, sections=[kind])
+    macros = select_macros(db[kind], selection) if selection else db[kind]
 
-testbasedir = pathlib.Path('test')
-testbasedir.mkdir(exist_ok=True)
-
-for kind in kinds:
-    for impl in implementations:
-        testdir = testbasedir / kind
-        testdir.mkdir(exist_ok=True)
-
-        testfile = open(testdir / f"{impl}.cpp", 'w+', encoding='ascii')
-
-        generator = TestsuiteGenerator(kind, impl)
+    with open(pathlib.Path('test') / kind / f"{impl}.cpp", 'w+', encoding='ascii') as testfile:
+        generator = TestsuiteGenerator(kind, impl, testfile)
 
         opts = set()
         pedantic_options = None
-        for macro in a[kind]:
+        for macro in macros:
             opts |= {tuple(x) for x in generator.make_options(macro)}
             if pedantic_options is None:
                 pedantic_options = generator.pedantic_options(macro)
@@ -35,7 +27,21 @@ for kind in kinds:
         if kind == 'library':
             testfile.write(library_prologue)
 
-        for macro in a[kind]:
+        for macro in macros:
             generator.generate_test_item(macro)
-        testfile.write(generator.output)
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--kind', nargs='+', choices=kinds, default=kinds, help='Kinds of macros to generate test files for (default: all)')
+    add_selection_arguments(parser)
+    args = parser.parse_args()
+
+    testbasedir = pathlib.Path('test')
+    testbasedir.mkdir(exist_ok=True)
+    for kind in args.kind:
+        (testbasedir / kind).mkdir(exist_ok=True)
+
+    with concurrent.futures.ProcessPoolExecutor() as pool:
+        futures = [pool.submit(generate_testfile, 'data.yaml', kind, impl, args) for kind in args.kind for impl in implementations]
+        for future in futures:
+            future.result()
@@ -1,29 +1,9 @@
 #!/usr/bin/env python3
-import argparse, logging, sys, textwrap, yaml
-from utilities import kinds, standards, infer_std
-
-def find_std_value(name):
-    for stdname, value in standards:
-        if stdname == name:
-            return value
-
-parser = argparse.ArgumentParser()
-parser.add_argument('kind', choices=kinds, help='Table to generate')
-parser.add_argument('-o', dest='outfilename', help='Output file name (use stdout if omitted)')
-parser.add_argument('--disable-warning', action='store_true')
-args = parser.parse_args()
-
-out = open(args.outfilename, 'w', encoding='utf-8') if args.outfilename else sys.stdout
-if args.disable_warning:
-    logging.disable(logging.WARNING)
-
-a = yaml.safe_load(open('data.yaml', encoding='utf-8'))
-
-if args.kind == 'attributes':
-    logging.critical("unimplemented")
-    exit()
-elif args.kind == 'language':
-    out.write("""\
+import argparse, hashlib, json, logging, pathlib, sys, textwrap, yaml
+from utilities import kinds, standards, standard_values, infer_std, add_selection_arguments, select_macros, atomic_write, FeatureDB
+
+headers = {
+    'language': """\
 {| class="wikitable sortable" style="font-size:90%;"
 |-
 ! style="width:0" | Macro name
@@ -31,9 +11,8 @@ elif args.kind == 'language':
 ! Value
 ! <abbr title="Standard in which the feature is introduced; DR means defect report against that revision">Std</abbr>
 ! Paper(s)
-""")
-elif args.kind == 'library':
-    out.write("""\
+""",
+    'library': """\
 {| class="wikitable sortable" style="font-size:90%;"
 |-
 ! style="width:0" | Macro name
@@ -42,103 +21,185 @@ elif args.kind == 'library':
 ! Header
 ! <abbr title="Standard in which the feature is introduced; DR means defect report against that revision">Std</abbr>
 ! Paper(s)
-""")
+""",
+}
 
-macros = a[args.kind]
-for item in macros:
+def render_macro(kind, item):
+    """The rows of the table for a macro, and the messages to log about it as (level, message)."""
+    out = []
+    messages = []
     rows = []
     papers = []
-    for row in item['rows']:
-        if 'papers' in row:
-            papers += row['papers'].split()
+    for row in item.rows:
+        if row.papers is not None:
+            papers += row.papers.split()
 
-        if 'cppreference-description' in row:
+        if row.cppreference_description is not None:
             prev = rows[-1] if len(rows) > 0 else None
-            if 'cppreference-treats-as-dr-against' in row:
-                row['std'] = row['cppreference-treats-as-dr-against']
-                stdvalue = find_std_value(row['std'])
-                if row['value'] <= stdvalue:
-                    logging.warning(textwrap.dedent(f'''\
-                        invalid DR for {item["name"]}
-                          standard: {row["std"]}
-                          printing: {row["value"]}'''))
-                elif prev and find_std_value(prev['std']) > stdvalue:
-                    logging.warning(textwrap.dedent(f'''\
-                        invalid DR for {item["name"]}
-                          standard: {row["std"]}
-                          printing: {row["value"]}
-                          previous: {prev["std"]}, {prev["value"]}'''))
+            if row.cppreference_treats_as_dr_against is not None:
+                std = row.cppreference_treats_as_dr_against
+                stdvalue = standard_values[std]
+                if row.value <= stdvalue:
+                    messages.append((logging.WARNING, textwrap.dedent(f'''\
+                        invalid DR for {item.name}
+                          standard: {std}
+                          printing: {row.value}''')))
+                elif prev and standard_values[prev[1]] > stdvalue:
+                    messages.append((logging.WARNING, textwrap.dedent(f'''\
+                        invalid DR for {item.name}
+                          standard: {std}
+                          printing: {row.value}
+                          previous: {prev[1]}, {prev[0].value}''')))
             else:
-                row['std'] = infer_std(row)
-
-                if prev and prev['std'] == row['std'] and row['std'] != standards[-1][0]:
-                    logging.warning(textwrap.dedent(f'''\
-                        there is a newer value for {item["name"]}
-                          standard: {row["std"]}
-                          printing: {row["value"]}
-                          previous value: {prev["value"]}
+                std = infer_std(row)
+
+                if prev and prev[1] == std and std != standards[-1][0]:
+                    messages.append((logging.WARNING, textwrap.dedent(f'''\
+                        there is a newer value for {item.name}
+                          standard: {std}
+                          printing: {row.value}
+                          previous value: {prev[0].value}
                           support:
-                        ''') + textwrap.indent(yaml.safe_dump(item['support']), '    '))
+                        ''') + textwrap.indent(yaml.safe_dump(item.to_dict()['support']), '    ')))
 
-            row['papers'] = papers
-            rows.append(row)
+            rows.append((row, std, papers))
             papers = []
 
-    for index, row in enumerate(rows):
+    for index, (row, std, papers) in enumerate(rows):
         if index == 0:
-            out.write(f'|- id="{item["name"][2:]}"\n')
+            out.append(f'|- id="{item.name[2:]}"\n')
             if len(rows) > 1:
-                out.write(f'| rowspan="{len(rows)}" | ')
+                out.append(f'| rowspan="{len(rows)}" | ')
             else:
-                out.write('| ')
+                out.append('| ')
             length_threshold = 30
-            if len(item['name']) > length_threshold:
-                break_point = item['name'].find('_', 15, 25) + 1
+            if len(item.name) > length_threshold:
+                break_point = item.name.find('_', 15, 25) + 1
                 if break_point == 0:
-                    break_point = item['name'].find('_', 10, 30) + 1
+                    break_point = item.name.find('_', 10, 30) + 1
                 if break_point == 0:
-                    logging.error(f'cannot find a break point for {item["name"]}')
-                out.write(f'{{{{tt|1={item["name"][:break_point]}{{{{br}}}}{item["name"][break_point:]}}}}} |')
+                    messages.append((logging.ERROR, f'cannot find a break point for {item.name}'))
+                out.append(f'{{{{tt|1={item.name[:break_point]}{{{{br}}}}{item.name[break_point:]}}}}} |')
             else:
-                out.write(f'{{{{tt|{item["name"]}}}}} |')
+                out.append(f'{{{{tt|{item.name}}}}} |')
         else:
-            out.write('|-\n')
+            out.append('|-\n')
 
-        out.write(f'| {row["cppreference-description"]}')
+        out.append(f'| {row.cppreference_description}')
 
-        out.write(f' || {{{{c|{row["value"]}L}}}}')
+        out.append(f' || {{{{c|{row.value}L}}}}')
 
-        if args.kind == 'library':
-            if 'cppreference-header_list' in row:
-                header_list = row['cppreference-header_list'].split(' ')
-            elif 'header_list' in item:
-                header_list = item['header_list'].split(' ')
+        if kind == 'library':
+            if row.cppreference_header_list is not None:
+                header_list = row.cppreference_header_list.split(' ')
+            elif item.header_list is not None:
+                header_list = item.header_list.split(' ')
             else:
                 header_list = ''
 
-            if len(header_list) > 2 and len(rows) > 1 and not any('cppreference-header_list' in row for row in rows):
+            if len(header_list) > 2 and len(rows) > 1 and not any(row.cppreference_header_list is not None for row, std, papers in rows):
                 if index == 0:
-                    out.write(f' || rowspan="{len(rows)}" | ')
-                    out.write(' '.join(f'{{{{header|{hdr}}}}}' for hdr in header_list))
+                    out.append(f' || rowspan="{len(rows)}" | ')
+                    out.append(' '.join(f'{{{{header|{hdr}}}}}' for hdr in header_list))
             else:
-                out.write(' || ')
-                out.write(' '.join(f'{{{{header|{hdr}}}}}' for hdr in header_list))
-
-        out.write(f' || {{{{mark {row["std"].lower()}}}}}')
-        if 'cppreference-treats-as-dr-against' in row:
-            out.write(f'<br>{{{{mark|DR}}}}')
-
-        papers = '<br>'.join(f'{{{{stddoc|{paper}}}}}' for paper in row['papers'])
-        out.write(f' || {papers}\n')
-
-out.write('|-\n')
-colspan = 6 if args.kind == 'library' else 5
-viable_macros = [item for item in macros if any('cppreference-description' in row for row in item['rows'])]
-
-if args.kind == 'library':
-    out.write(f'! colspan="{colspan}" | Total number of macros: {len(viable_macros)} <!-- do not forget to update, see the talk page -->\n')
-else:
-    out.write(f'! colspan="{colspan}" | Total number of macros: {len(viable_macros)} <!-- update me, e.g., use the script on the talk page -->\n')
-
-out.write('|}')
-
+                out.append(' || ')
+                out.append(' '.join(f'{{{{header|{hdr}}}}}' for hdr in header_list))
+
+        out.append(f' || {{{{mark {std.lower()}}}}}')
+        if row.cppreference_treats_as_dr_against is not None:
+            out.append(f'<br>{{{{mark|DR}}}}')
+
+        papers = '<br>'.join(f'{{{{stddoc|{paper}}}}}' for paper in papers)
+        out.append(f' || {papers}\n')
+    return ''.join(out), messages
+
+def footer(kind, macros):
+    colspan = 6 if kind == 'library' else 5
+    viable_macros = [item for item in macros if any(row.cppreference_description is not None for row in item.rows)]
+    if kind == 'library':
+        return f'|-\n! colspan="{colspan}" | Total number of macros: {len(viable_macros)} <!-- do not forget to update, see the talk page -->\n|}}'
+    else:
+        return f'|-\n! colspan="{colspan}" | Total number of macros: {len(viable_macros)} <!-- update me, e.g., use the script on the talk page -->\n|}}'
+
+class FragmentCache:
+    """The rendered rows of each macro from the previous runs, keyed by a hash of the
+    macro's entry in data.yaml and of the code that renders it."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self.fragments = json.load(open(path, encoding='utf-8'))
+        except (OSError, ValueError):
+            self.fragments = {}
+
+    def save(self):
+        atomic_write(self.path, json.dumps(self.fragments, indent=1))
+
+code_hash = hashlib.sha256(b''.join(open(pathlib.Path(__file__).parent / name, 'rb').read()
+                                    for name in ['maketable_cppreference.py', 'utilities.py'])).hexdigest()
+
+def make_table(kind, db, args, cache):
+    """The table of the selected macros of a kind, or with args.changed, only the rows of the
+    macros whose rendering differs from the cached one."""
+    macros = select_macros(db[kind], args)
+    out = [] if args.changed else [headers[kind]]
+    for item in macros:
+        key = hashlib.sha256(json.dumps([code_hash, kind, item.to_dict()]).encode('utf-8')).hexdigest()
+        cached = cache.fragments.get(item.name)
+        if cached and cached['key'] == key:
+            text, messages = cached['text'], cached['messages']
+        else:
+            text, messages = render_macro(kind, item)
+            cache.fragments[item.name] = {'key': key, 'text': text, 'messages': messages}
+        for level, message in messages:
+            logging.log(level, message)
+        if not args.changed or not cached or cached['text'] != text:
+            out.append(text)
+
+    names = {item.name for item in db[kind]}
+    for name in [name for name in cache.fragments if name not in names]:
+        if args.changed:
+            out.append(f'<!-- removed: {name} -->\n')
+        del cache.fragments[name]
+    if not args.changed:
+        out.append(footer(kind, macros))
+    return ''.join(out)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('kind', nargs='+', choices=kinds, help='Tables to generate')
+    parser.add_argument('-o', dest='outfilename', help='''Output file name (use stdout if omitted). With several tables,
+                                                          {kind} in the name is replaced to write each to its own file.''')
+    parser.add_argument('--disable-warning', action='store_true')
+    parser.add_argument('--changed', action='store_true', help='Only output the rows of the macros whose rendering changed since the previous run')
+    parser.add_argument('--cache-dir', default='.cache/cppreference', help='Directory of the rendered rows of the previous runs (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true', help='Render every macro, neither reading nor updating the cache')
+    add_selection_arguments(parser)
+    args = parser.parse_args()
+    if args.no_cache and args.changed:
+        parser.error('--changed needs the cache of the previous run')
+
+    if args.disable_warning:
+        logging.disable(logging.WARNING)
+
+    if 'attributes' in args.kind:
+        logging.critical("unimplemented")
+        exit()
+
+    db = FeatureDB.load(sections=args.kind)
+
+    tables = []
+    for kind in args.kind:
+        cache = FragmentCache(pathlib.Path(args.cache_dir) / f'{kind}.json')
+        if args.no_cache:
+            cache.fragments = {}
+        tables.append((kind, make_table(kind, db, args, cache)))
+        if not args.no_cache:
+            cache.save()
+
+    if args.outfilename and '{kind}' in args.outfilename:
+        for kind, table in tables:
+            open(args.outfilename.format(kind=kind), 'w', encoding='utf-8').write(table)
+    else:
+        out = open(args.outfilename, 'w', encoding='utf-8') if args.outfilename else sys.stdout
+        out.write('\n\n'.join(table for kind, table in tables if table))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+import argparse, datetime, fnmatch, json, pathlib, re, sqlite3, sys
+
+schema = '''
+create table if not exists runs (
+    id integer primary key,
+    started text not null,
+    compiler text not null,
+    compiler_id text not null,
+    compiler_version text,
+    impl text not null,
+    kind text not null,
+    extra_args text not null,
+    exitcode integer
+);
+create table if not exists results (
+    run_id integer not null references runs(id),
+    macro text not null,
+    std text,
+    options text not null,
+    expected integer,
+    observed integer,
+    passed integer not null,
+    duration real
+);
+create index if not exists runs_configuration on runs(impl, kind, compiler, extra_args);
+create index if not exists results_run on results(run_id, macro);
+create index if not exists results_macro on results(macro, std);
+'''
+
+expected_message = re.compile(r'(\S+) is (?:not equal to (\d+)|defined|nonzero)')
+
+def parse_value(text):
+    """The value of a macro as preprocessed by the compiler; None if it was left unexpanded."""
+    match = re.fullmatch(r'\(?(\d+)[uUlL]*\)?', text.strip())
+    return int(match[1]) if match else None
+
+def observed_value(stdout, s):
+    """The value the compiler gave the macro tested on the line starting with s."""
+    if s not in stdout:
+        return None
+    return parse_value(stdout[stdout.index(s) + len(s):].split('\n', 1)[0])
+
+def accepted_value(res, observed):
+    """The value the test accepts: the observed one if it passed, else the one its #error names.
+    None if the macro must not be defined, or if the test failed for an unrelated reason."""
+    if res.stderr.strip() == '':
+        return observed
+    match = expected_message.search(res.stderr)
+    return int(match[2]) if match and match[2] else None
+
+class ResultStore:
+    """SQLite database of the values observed by do_test.py. Each run of a configuration
+    (impl, kind, compiler and extra arguments) gets a row in `runs`, and each compiler
+    invocation of a macro a row in `results`."""
+
+    def __init__(self, path):
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(schema)
+
+    def record(self, configuration, results):
+        """Store a run; configuration has the columns of `runs`, each result those of `results`."""
+        with self.db:
+            cursor = self.db.execute('insert into runs (started, compiler, compiler_id, compiler_version, impl, kind, extra_args, exitcode) '
+                                     'values (:started, :compiler, :compiler_id, :compiler_version, :impl, :kind, :extra_args, :exitcode)',
+                                     {'started': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+                                      **configuration, 'extra_args': json.dumps(configuration['extra_args'])})
+            self.db.executemany('insert into results values (?, ?, ?, ?, ?, ?, ?, ?)',
+                                [(cursor.lastrowid, result['macro'], result['std'], json.dumps(result['options']),
+                                  result['expected'], result['observed'], result['passed'], result['duration']) for result in results])
+        return cursor.lastrowid
+
+    def runs(self, impl=None, kind=None, latest=False):
+        """Runs matching impl and kind, newest first; with latest, only the newest run of each configuration."""
+        query = 'select * from runs where (:impl is null or impl = :impl) and (:kind is null or kind = :kind)'
+        if latest:
+            query += ' and id in (select max(id) from runs group by impl, kind, compiler, extra_args)'
+        return self.db.execute(query + ' order by id desc', {'impl': impl, 'kind': kind}).fetchall()
+
+    def run(self, run_id):
+        return self.db.execute('select * from runs where id = ?', (run_id,)).fetchone()
+
+    def previous(self, run):
+        """The run of the same configuration before the given one."""
+        return self.db.execute('select * from runs where impl = ? and kind = ? and compiler = ? and extra_args = ? and id < ? '
+                               'order by id desc limit 1', (run['impl'], run['kind'], run['compiler'], run['extra_args'], run['id'])).fetchone()
+
+    def results(self, run_id, std=None, macro=None, failed=False):
+        query = 'select * from results where run_id = :run_id and (:std is null or std = :std)'
+        if failed:
+            query += ' and not passed'
+        rows = self.db.execute(query + ' order by rowid', {'run_id': run_id, 'std': std}).fetchall()
+        return [row for row in rows if macro is None or fnmatch.fnmatchcase(row['macro'], macro)]
+
+    def diff(self, old_id, new_id):
+        """Invocations whose outcome differs between two runs, as (key, old row, new row);
+        either row is None if the invocation only exists in one of the runs."""
+        old = {(row['macro'], row['options']): row for row in self.results(old_id)}
+        new = {(row['macro'], row['options']): row for row in self.results(new_id)}
+        changes = []
+        for key in [*old, *[key for key in new if key not in old]]:
+            a, b = old.get(key), new.get(key)
+            if a is None or b is None or (a['observed'], a['expected'], a['passed']) != (b['observed'], b['expected'], b['passed']):
+                changes.append((key, a, b))
+        return changes
+
+    def export(self, run_ids):
+        return [{**dict(run), 'extra_args': json.loads(run['extra_args']),
+                 'results': [{**dict(row), 'options': json.loads(row['options']), 'passed': bool(row['passed'])}
+                             for row in self.results(run['id'])]}
+                for run in map(self.run, run_ids)]
+
+def describe(run):
+    return ' '.join([f'#{run["id"]}', run['started'], run['impl'], run['kind'], f'(cc: {run["compiler"]})', *json.loads(run['extra_args'])])
+
+def show(row):
+    value = lambda value: 'undefined' if value is None else value
+    status = 'pass' if row['passed'] else 'FAIL' if row['expected'] == row['observed'] else f'FAIL, expected {value(row["expected"])}'
+    return f'{row["macro"]} {" ".join(json.loads(row["options"]))}: {value(row["observed"])} ({status})'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Query the values recorded by do_test.py.')
+    parser.add_argument('--db', default='.cache/results.sqlite', help='Result database (default: %(default)s)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    runs_parser = subparsers.add_parser('runs', help='List the recorded runs')
+    failures_parser = subparsers.add_parser('failures', help='Show the failures of the latest run of each configuration')
+    diff_parser = subparsers.add_parser('diff', help='Show what changed since the previous run of the same configuration')
+    diff_parser.add_argument('runs', nargs='*', type=int, metavar='RUN', help='Compare two runs, or a run with its previous one')
+    export_parser = subparsers.add_parser('export', help='Write runs and their results as JSON')
+    export_parser.add_argument('runs', nargs='*', type=int, metavar='RUN', help='Runs to export (default: the latest run of each configuration)')
+    export_parser.add_argument('-o', dest='outfilename', help='Output file name (use stdout if omitted)')
+    for subparser in [runs_parser, failures_parser, diff_parser, export_parser]:
+        subparser.add_argument('--impl', help='Only consider runs of this implementation')
+        subparser.add_argument('--kind', help='Only consider runs of this kind')
+    for subparser in [failures_parser, diff_parser]:
+        subparser.add_argument('--std', help='Only show invocations with this standard, e.g. C++26')
+        subparser.add_argument('--macro', help='Only show macros matching this glob pattern')
+    args = parser.parse_args()
+
+    store = ResultStore(args.db)
+    if args.command == 'runs':
+        for run in store.runs(args.impl, args.kind):
+            print(describe(run), f'exit code {run["exitcode"]}')
+    elif args.command == 'failures':
+        for run in store.runs(args.impl, args.kind, latest=True):
+            failures = store.results(run['id'], args.std, args.macro, failed=True)
+            print(describe(run) + f': {len(failures)} failure(s)')
+            for row in failures:
+                print('  ' + show(row))
+    elif args.command == 'diff':
+        if len(args.runs) > 2:
+            parser.error('diff takes at most two runs')
+        pairs = []
+        for run in [store.run(run_id) for run_id in args.runs[-1:]] or store.runs(args.impl, args.kind, latest=True):
+            if run is None:
+                parser.error(f'no run {args.runs[-1]}')
+            old = store.run(args.runs[0]) if len(args.runs) == 2 else store.previous(run)
+            if old is not None:
+                pairs.append((old, run))
+        for old, new in pairs:
+            changes = [(key, a, b) for key, a, b in store.diff(old['id'], new['id'])
+                       if (args.std is None or args.std in [row['std'] for row in [a, b] if row])
+                       and (args.macro is None or fnmatch.fnmatchcase(key[0], args.macro))]
+            print(f'{describe(old)} -> #{new["id"]} {new["started"]}: {len(changes)} change(s)')
+            if old['compiler_id'] != new['compiler_id']:
+                print(f'  compiler: {old["compiler_version"]} -> {new["compiler_version"]}')
+            for key, a, b in changes:
+                print('  ' + (f'- {show(a)}' if b is None else f'+ {show(b)}' if a is None else f'{show(a)} -> {show(b)}'))
+    elif args.command == 'export':
+        run_ids = args.runs or [run['id'] for run in store.runs(args.impl, args.kind, latest=True)]
+        out = open(args.outfilename, 'w', encoding='utf-8') if args.outfilename else sys.stdout
+        json.dump(store.export(run_ids), out, indent=1)
+        out.write('\n')
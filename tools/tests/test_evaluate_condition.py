@@ -0,0 +1,49 @@
+import pathlib, sys, unittest
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from utilities import evaluate_condition
+
+class EvaluateConditionTest(unittest.TestCase):
+    macros = {'__cplusplus': '201703L', '_GLIBCXX_RELEASE': '12', 'EMPTY': '', 'ALIAS': '_GLIBCXX_RELEASE', 'FUNC': None}
+
+    def evaluate(self, expr):
+        return evaluate_condition(expr, self.macros)
+
+    def test_defined(self):
+        self.assertEqual(self.evaluate('defined(__cplusplus)'), 1)
+        self.assertEqual(self.evaluate('defined __cplusplus'), 1)
+        self.assertEqual(self.evaluate('defined(__cpp_lib_any)'), 0)
+        self.assertEqual(self.evaluate('!defined __cpp_lib_any'), 1)
+        self.assertEqual(self.evaluate('defined(FUNC)'), 1)
+
+    def test_logical_operators(self):
+        self.assertEqual(self.evaluate('defined(__cplusplus) && __cplusplus >= 201703L'), 1)
+        self.assertEqual(self.evaluate('defined(__cplusplus) && __cplusplus > 201703L'), 0)
+        self.assertEqual(self.evaluate('__cplusplus > 201703L || _GLIBCXX_RELEASE >= 12'), 1)
+        self.assertEqual(self.evaluate('0 || 1 && 0'), 0)
+        self.assertEqual(self.evaluate('(0 || 1) && 1'), 1)
+        self.assertEqual(self.evaluate('ALIAS == 12 ? 2 : 3'), 2)
+
+    def test_integer_suffixes(self):
+        self.assertEqual(self.evaluate('202002L'), 202002)
+        self.assertEqual(self.evaluate('202002uL == 202002ULL'), 1)
+        self.assertEqual(self.evaluate('0x10u'), 16)
+        self.assertEqual(self.evaluate('010'), 8)
+        self.assertEqual(self.evaluate('__cplusplus'), 201703)
+
+    def test_unknown_identifiers_are_zero(self):
+        self.assertEqual(self.evaluate('__cpp_lib_any'), 0)
+        self.assertEqual(self.evaluate('true && !false'), 1)
+
+    def test_malformed(self):
+        for expr in ['(1', '((1) && 2', '1)', '(', 'defined', 'defined(', 'defined(X', 'defined()', '1 ? 2', '1 &&', '08', '1 $ 2']:
+            with self.subTest(expr=expr), self.assertRaises(ValueError) as context:
+                self.evaluate(expr)
+            self.assertIn(repr(expr), str(context.exception))
+
+    def test_cannot_evaluate(self):
+        for expr in ['__has_builtin(__builtin_launder)', 'FUNC(1)', 'EMPTY + 1 / 0']:
+            with self.subTest(expr=expr), self.assertRaises(ValueError):
+                self.evaluate(expr)
+
+if __name__ == '__main__':
+    unittest.main()
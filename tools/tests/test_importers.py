@@ -0,0 +1,81 @@
+import pathlib, sys, tempfile, unittest
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent))
+from utilities import SupportItem
+from update_from_libcxx_version import read_version
+from update_from_msvc_stl_yvals_core import read_yvals_core
+
+libcxx_version = '''\
+// -*- C++ -*-
+#ifndef _LIBCPP_VERSIONH
+#define _LIBCPP_VERSIONH
+
+#include <__config>
+
+#if _LIBCPP_STD_VER >= 17
+#  define __cpp_lib_array_constexpr 201603L
+#  define __cpp_lib_removed 201606L
+#  if _LIBCPP_HAS_THREADS
+#    define __cpp_lib_shared_mutex 201505L
+#  endif
+// #  define __cpp_lib_execution 201603L
+#endif
+
+#if _LIBCPP_STD_VER >= 20
+#  undef __cpp_lib_array_constexpr
+#  define __cpp_lib_array_constexpr 201811L
+#endif
+
+#undef __cpp_lib_removed
+
+#endif // _LIBCPP_VERSIONH
+'''
+
+yvals_core = '''\
+#ifndef _YVALS_CORE_H_
+#define _YVALS_CORE_H_
+#if _STL_COMPILER_PREPROCESSOR
+
+#define __cpp_lib_any 201606L
+#define __cpp_lib_removed 201606L
+
+#if _HAS_CXX20 && defined(__cpp_char8_t)
+#define __cpp_lib_char8_t 201907L
+#endif
+
+// #define __cpp_lib_execution 201603L
+
+#ifdef _M_CEE_PURE
+#undef __cpp_lib_any
+#endif
+#undef __cpp_lib_removed
+
+#endif // _STL_COMPILER_PREPROCESSOR
+#endif // _YVALS_CORE_H_
+'''
+
+class ImporterTest(unittest.TestCase):
+    def read(self, reader, relative, text):
+        with tempfile.TemporaryDirectory() as directory:
+            path = pathlib.Path(directory) / relative
+            path.parent.mkdir(parents=True)
+            path.write_text(text, encoding='utf-8')
+            return reader(directory)
+
+    def test_libcxx(self):
+        support = self.read(read_version, 'libcxx/include/version', libcxx_version)
+        self.assertEqual(support, {
+            '__cpp_lib_array_constexpr': [SupportItem(since='C++17', value=201603), SupportItem(since='C++20', value=201811)],
+            '__cpp_lib_shared_mutex': [SupportItem(since='C++17', depends='_LIBCPP_HAS_THREADS', value=201505)],
+            '__cpp_lib_execution': None,
+        })
+
+    def test_msvc_stl(self):
+        support = self.read(read_yvals_core, 'stl/inc/yvals_core.h', yvals_core)
+        self.assertEqual(support, {
+            '__cpp_lib_any': [SupportItem(value=201606)],
+            '__cpp_lib_char8_t': [SupportItem(since='C++20', depends='defined(__cpp_char8_t)', value=201907)],
+            '__cpp_lib_execution': None,
+        })
+
+if __name__ == '__main__':
+    unittest.main()
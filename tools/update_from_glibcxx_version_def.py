@@ -1,121 +1,129 @@
 #!/usr/bin/env python3
-import argparse, re, sys, yaml
-
-parser = argparse.ArgumentParser()
-parser.add_argument('input_filename', help='libstdc++ version.def file')
-parser.add_argument('output_filename', help='output file name')
-
-args = parser.parse_args()
-
-s = open(args.input_filename, encoding='ascii').read()
-
-s = re.sub(r'//.*?\n', '', s)
-s = re.sub(r'/\*.*?\*/', '', s)
-s = re.sub(r'AutoGen Definitions.*;', '', s)
-
-s = s.strip()
-
-tokens = []
-
-while s:
-    match = re.match(r'\w+|".*?"', s)
-    if match:
-        word = match.group()
-        tokens.append(word)
-        s = s[len(word):].lstrip()
-    else:
-        tok = s[0]
-        tokens.append(tok)
-        s = s[1:].lstrip()
-
-
-def recursive_parse_definitions():
-    result = dict()
-
-    global tokens
-
-    while tokens and re.fullmatch(r'\w+', tokens[0]):
-        pos = tokens.index('=')
-        itemname = ''.join(tokens[:pos])
-
-        tokens = tokens[pos+1:]
-
-        if tokens[0] == '{':
-            result.setdefault(itemname, [])
-            tokens = tokens[1:]
-            parsed = recursive_parse_definitions()
-            assert tokens[0] == '}'
-            assert tokens[1] == ';'
-            tokens = tokens[2:]
-            result[itemname].append(parsed)
-        else:
-            pos = tokens.index(';')
-            if pos != 1:
-                assert tokens[0].startswith('"')
-
-            assert itemname not in result
-            result[itemname] = ''.join(tokens[:pos])
-            tokens = tokens[pos+1:]
-
+import re
+from utilities import run_importer, SupportItem
+
+class VersionDefError(ValueError):
+    pass
+
+version_def_token = re.compile(r'''(?:\s+|//[^\n]*|/\*.*?\*/)*(\w+|"[^"\n]*"|\S)''', re.S)
+
+def tokenize_version_def(text):
+    """Split AutoGen definitions into tokens, dropping whitespace and comments."""
+    return version_def_token.findall(text)
+
+def parse_version_def(text, filename='version.def'):
+    """Parse the AutoGen definitions of libstdc++'s version.def. A definition
+    `name = value;` becomes a string item of the returned dict, and every
+    `name = { ... };` is parsed recursively and appended to the list named `name`."""
+    tokens = tokenize_version_def(text)
+    tokens.append('')
+    end = len(tokens) - 1
+    pos = 0
+
+    def error(message):
+        # Offsets are only needed here, so they are recovered by tokenizing again.
+        offset = len(text)
+        for index, match in enumerate(version_def_token.finditer(text)):
+            if index == pos:
+                offset = match.start(1)
+                break
+        line = text.count('\n', 0, offset) + 1
+        column = offset - text.rfind('\n', 0, offset)
+        found = repr(tokens[pos]) if pos < end else 'end of file'
+        return VersionDefError(f'{filename}:{line}:{column}: {message}, found {found}')
+
+    def expect(punct):
+        nonlocal pos
+        if tokens[pos] != punct:
+            raise error(f'expected {punct!r}')
+        pos += 1
+
+    def definitions():
+        nonlocal pos
+        result = dict()
+        while tokens[pos][:1].isalnum() or tokens[pos][:1] == '_':
+            start = pos
+            while pos < end and tokens[pos] not in ['=', ';', '{', '}']:
+                pos += 1
+            itemname = ''.join(tokens[start:pos])
+            expect('=')
+
+            if tokens[pos] == '{':
+                pos += 1
+                parsed = definitions()
+                expect('}')
+                expect(';')
+                result.setdefault(itemname, []).append(parsed)
+            else:
+                start = pos
+                if tokens[pos].startswith('"'):
+                    while tokens[pos].startswith('"'):
+                        pos += 1
+                elif pos < end and tokens[pos] not in ['=', ';', '{', '}']:
+                    pos += 1
+                else:
+                    raise error(f'expected a value for {itemname}')
+                if itemname in result:
+                    pos = start
+                    raise error(f'duplicate definition of {itemname}')
+                result[itemname] = ''.join(tokens[start:pos])
+                expect(';')
+        return result
+
+    if tokens[:2] == ['AutoGen', 'Definitions']:
+        while pos < end and tokens[pos] != ';':
+            pos += 1
+        expect(';')
+    result = definitions()
+    if pos != end:
+        raise error('expected a definition')
     return result
 
-
-raw = recursive_parse_definitions()
-
-with open('data.yaml', encoding='utf-8') as data:
-    doc = yaml.safe_load(data)
-
-    for ftm in raw['ftms']:
-        name = f"__cpp_lib_{ftm['name']}"
-
-        if 'no_stdname' in ftm or all('no_stdname' in value for value in ftm['values']):
-            continue
-
-        macro = None
-        for it in doc['library']:
-            if it['name'] == name:
-                macro = it
-
-        if not macro:
-            print(f"warning: cannot find macro {name}", file=sys.stderr)
-
-        if macro:
-            support = []
-            for value in ftm['values']:
-                row = dict()
-
-                if 'cxxmin' in value:
-                    row['since'] = f"C++{value['cxxmin']}"
-
-                depends = []
-                if 'gthread' in value:
-                    if value['gthread'] == 'yes':
-                        depends.append('defined(_GLIBCXX_HAS_GTHREADS)')
-                    else:
-                        assert value['gthread'] == 'no'
-                        depends.append('!defined(_GLIBCXX_HAS_GTHREADS)')
-
-                if 'cxx11abi' in value:
-                    if value['cxx11abi'] == 'yes':
-                        depends.append('_GLIBCXX_USE_CXX11_ABI')
-                    else:
-                        assert value['cxx11abi'] == 'no'
-                        depends.append('!_GLIBCXX_USE_CXX11_ABI')
-
-                if 'extra_cond' in value:
-                    extra_cond = value['extra_cond']
-                    extra_cond = re.sub('"', '', extra_cond)
-                    extra_cond = re.sub('__glibcxx_', '__cpp_lib_', extra_cond)
-                    depends.append(extra_cond)
-
-                if depends:
-                    row['depends'] = ' && '.join(depends)
-
-                row['value'] = int(value['v'])
-
-                support.append(row)
-
-            support.reverse()
-            macro['support']['gcc'] = support or None
-
-yaml.safe_dump(doc, open(args.output_filename, 'w', encoding='utf-8'), allow_unicode=True, sort_keys=False)
+def ftm_support(ftm):
+    """The gcc support entries of data.yaml for an ftms entry of version.def."""
+    support = []
+    for value in ftm['values']:
+        row = dict()
+
+        if 'cxxmin' in value:
+            row['since'] = f"C++{value['cxxmin']}"
+
+        depends = []
+        if 'gthread' in value:
+            if value['gthread'] == 'yes':
+                depends.append('defined(_GLIBCXX_HAS_GTHREADS)')
+            else:
+                assert value['gthread'] == 'no'
+                depends.append('!defined(_GLIBCXX_HAS_GTHREADS)')
+
+        if 'cxx11abi' in value:
+            if value['cxx11abi'] == 'yes':
+                depends.append('_GLIBCXX_USE_CXX11_ABI')
+            else:
+                assert value['cxx11abi'] == 'no'
+                depends.append('!_GLIBCXX_USE_CXX11_ABI')
+
+        if 'extra_cond' in value:
+            extra_cond = value['extra_cond']
+            extra_cond = re.sub('"', '', extra_cond)
+            extra_cond = re.sub('__glibcxx_', '__cpp_lib_', extra_cond)
+            depends.append(extra_cond)
+
+        if depends:
+            row['depends'] = ' && '.join(depends)
+
+        row['value'] = int(value['v'])
+
+        support.append(SupportItem(**row))
+
+    support.reverse()
+    return support or None
+
+def read_version_def(path):
+    """The gcc support entries of data.yaml for the macros of libstdc++'s version.def."""
+    raw = parse_version_def(open(path, encoding='ascii').read(), path)
+    return {f"__cpp_lib_{ftm['name']}": ftm_support(ftm) for ftm in raw['ftms']
+            if not ('no_stdname' in ftm or all('no_stdname' in value for value in ftm['values']))}
+
+if __name__ == '__main__':
+    run_importer('gcc', read_version_def, 'libstdc++ version.def file')
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+import re
+from utilities import standards, standard_index, locate_source, run_importer, scan_feature_macros
+
+libcxx_std_ver = re.compile(r'_LIBCPP_STD_VER\s*(>=|>)\s*(\d+)')
+
+def classify(condition):
+    """The standard that a condition of libc++'s <version> gates, see scan_feature_macros."""
+    match = libcxx_std_ver.fullmatch(condition)
+    if match:
+        std = f'C++{match[2]}'
+        if std not in standard_index:
+            return None
+        return standards[standard_index[std] + 1][0] if match[1] == '>' else std
+    # The frozen C++03 headers are a configuration of their own, which data.yaml is not about.
+    if '_LIBCPP_USE_FROZEN_CXX03_HEADERS' in condition:
+        return False
+    return None
+
+def read_version(path):
+    """The clang support entries of data.yaml for the macros of libc++'s <version>."""
+    path = locate_source(path, ['libcxx/include/version', 'include/version'])
+    return scan_feature_macros(open(path, encoding='utf-8').read(), classify)
+
+if __name__ == '__main__':
+    run_importer('clang', read_version, 'libc++ <version> header, or a checkout of llvm-project or libc++')
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+import re
+from utilities import standard_index, locate_source, run_importer, scan_feature_macros
+
+has_cxx = re.compile(r'_HAS_CXX(\d+)')
+
+def classify(condition):
+    """The standard that a condition of the MSVC STL's yvals_core.h gates, see scan_feature_macros."""
+    match = has_cxx.fullmatch(condition)
+    if match and f'C++{match[1]}' in standard_index:
+        return f'C++{match[1]}'
+    # The STL only works with compilers that define this.
+    if condition == '_STL_COMPILER_PREPROCESSOR':
+        return True
+    return None
+
+def read_yvals_core(path):
+    """The msvc support entries of data.yaml for the macros of the MSVC STL's yvals_core.h."""
+    path = locate_source(path, ['stl/inc/yvals_core.h', 'inc/yvals_core.h'])
+    return scan_feature_macros(open(path, encoding='utf-8').read(), classify)
+
+if __name__ == '__main__':
+    run_importer('msvc', read_yvals_core, 'yvals_core.h of the MSVC STL, or a checkout of the STL')
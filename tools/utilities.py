@@ -1,3 +1,5 @@
+import argparse, fnmatch, functools, hashlib, os, pathlib, pickle, re, sys, threading, yaml
+
 kinds = ['attributes', 'language', 'library']
 implementations = ['clang', 'gcc', 'msvc']
 standards = [
@@ -11,10 +13,418 @@ standards = [
     ('C++29', None),
 ]
 
+standard_values = dict(standards)
+standard_index = {std: index for index, (std, __cplusplus) in enumerate(standards)}
+
 library_prologue = """\
 #include <version>
 """
 
+def atomic_write(path, text):
+    """Write text (str or bytes) to path, creating its directory if needed. The text goes to
+    a temporary file that then replaces path, so that concurrent readers never see half of it."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    with open(temp, 'wb') if isinstance(text, bytes) else open(temp, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp, path)
+
+yaml_loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+top_level_key = re.compile(r'^([A-Za-z_][\w-]*):', re.M)
+
+def split_sections(text):
+    """Split the text of data.yaml at its top-level keys, so that each section can be parsed
+    on its own."""
+    starts = list(top_level_key.finditer(text))
+    return {start[1]: text[start.start():end.start() if end else len(text)] for start, end in zip(starts, [*starts[1:], None])}
+
+def parse_data(text, sections=None):
+    """Parse data.yaml, or only the given top-level sections of it."""
+    if sections is None:
+        return yaml.load(text, Loader=yaml_loader)
+    parts = split_sections(text)
+    return {section: yaml.load(parts[section], Loader=yaml_loader)[section] for section in sections}
+
+def load_data(path='data.yaml', snapshot_dir='.cache/snapshots', sections=None):
+    """Load data.yaml, or only the given top-level sections of it. Each section is parsed
+    on its own, and a pickled snapshot of it is reused as long as its text is unchanged."""
+    path = pathlib.Path(path)
+    parts = split_sections(path.read_text(encoding='utf-8'))
+    prefix = hashlib.sha256(str(path.resolve()).encode()).hexdigest()[:16]
+    data = {}
+    for section in parts if sections is None else sections:
+        text = parts[section]
+        key = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        snapshot = pathlib.Path(snapshot_dir) / f'{prefix}-{section}.pickle'
+        try:
+            with open(snapshot, 'rb') as f:
+                if pickle.load(f) == key:
+                    data[section] = pickle.load(f)
+                    continue
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        data[section] = yaml.load(text, Loader=yaml_loader)[section]
+        try:
+            atomic_write(snapshot, pickle.dumps(key, pickle.HIGHEST_PROTOCOL) + pickle.dumps(data[section], pickle.HIGHEST_PROTOCOL))
+        except OSError:
+            pass
+    return data
+
+class Record:
+    """Base class of the entries of a FeatureDB. `fields` maps the keys used in
+    data.yaml to attribute names; absent keys are None. The original order of the
+    keys and any unknown keys are kept, so that to_dict() gives back the input."""
+    __slots__ = ('order', 'extra')
+    fields = {}
+
+    def __init__(self, **kwargs):
+        attributes = {attr: key for key, attr in self.fields.items()}
+        for attr in self.fields.values():
+            setattr(self, attr, None)
+        for attr, value in kwargs.items():
+            setattr(self, attr, value)
+        self.order = tuple(attributes[attr] for attr in kwargs)
+        self.extra = None
+
+    @classmethod
+    def from_dict(cls, entry):
+        record = cls()
+        for key, value in entry.items():
+            if key in cls.fields:
+                setattr(record, cls.fields[key], record.load_field(key, value))
+            else:
+                record.extra = {**(record.extra or {}), key: value}
+        record.order = tuple(entry)
+        return record
+
+    def to_dict(self):
+        result = {}
+        for key in [*self.order, *[key for key in self.fields if key not in self.order]]:
+            if key in self.fields:
+                value = getattr(self, self.fields[key])
+                if value is not None:
+                    result[key] = self.dump_field(key, value)
+            elif key in (self.extra or {}):
+                result[key] = self.extra[key]
+        return result
+
+    def load_field(self, key, value):
+        return value
+
+    def dump_field(self, key, value):
+        return value
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.to_dict() == other.to_dict()
+
+    def __repr__(self):
+        return f'{type(self).__name__}({self.to_dict()!r})'
+
+class SupportItem(Record):
+    __slots__ = ('since', 'option', 'enabled_by', 'disabled_by', 'depends', 'pedantic', 'value')
+    fields = {'since': 'since', 'option': 'option', 'enabled-by': 'enabled_by', 'disabled-by': 'disabled_by',
+              'depends': 'depends', 'pedantic': 'pedantic', 'value': 'value'}
+
+class Row(Record):
+    __slots__ = ('value', 'papers', 'feature', 'cppreference_description', 'cppreference_header_list',
+                 'cppreference_treats_as_dr_against')
+    fields = {'value': 'value', 'papers': 'papers', 'feature': 'feature',
+              'cppreference-description': 'cppreference_description',
+              'cppreference-header_list': 'cppreference_header_list',
+              'cppreference-treats-as-dr-against': 'cppreference_treats_as_dr_against'}
+
+class Macro(Record):
+    """A feature-test macro (or attribute). `support` maps each implementation to
+    its list of SupportItem, or None if it does not support the macro at all."""
+    __slots__ = ('name', 'rows', 'header_list', 'support')
+    fields = {'name': 'name', 'rows': 'rows', 'header_list': 'header_list', 'support': 'support'}
+
+    def load_field(self, key, value):
+        if key == 'rows':
+            return [Row.from_dict(row) for row in value]
+        elif key == 'support':
+            return {impl: None if items is None else [SupportItem.from_dict(item) for item in items]
+                    for impl, items in value.items()}
+        return value
+
+    def dump_field(self, key, value):
+        if key == 'rows':
+            return [row.to_dict() for row in value]
+        elif key == 'support':
+            return {impl: None if items is None else [item.to_dict() for item in items]
+                    for impl, items in value.items()}
+        return value
+
+    def papers(self):
+        return [paper for row in self.rows if row.papers for paper in row.papers.split()]
+
+class FeatureDB:
+    """data.yaml as Macro records, grouped by kind and indexed by name."""
+
+    def __init__(self, data):
+        assert all(kind in kinds for kind in data), list(data)
+        self.sections = {kind: [Macro.from_dict(macro) for macro in data[kind]] for kind in kinds if kind in data}
+        self.by_name = {macro.name: macro for macros in self.sections.values() for macro in macros}
+
+    @classmethod
+    def load(cls, path='data.yaml', sections=None):
+        """Load data.yaml, or only the given kinds of macros."""
+        return cls(load_data(path, sections=sections))
+
+    def __getitem__(self, kind):
+        return self.sections[kind]
+
+    def macro(self, name):
+        return self.by_name.get(name)
+
+class DataPatchError(Exception):
+    pass
+
+def dump_support(impl, items, column):
+    """`impl: items` the way yaml.safe_dump writes it when the key is at the given column."""
+    text = yaml.safe_dump({impl: None if items is None else [item.to_dict() for item in items]},
+                          allow_unicode=True, sort_keys=False, width=80 - column)
+    return text.rstrip('\n').replace('\n', '\n' + ' ' * column)
+
+def node_end(node):
+    """The index after the last character of a node. Block collections end at the next
+    token, after the line breaks, indentation and comments that follow them, so their
+    end is that of their last item."""
+    if isinstance(node, yaml.ScalarNode) or node.flow_style:
+        return node.end_mark.index
+    last = node.value[-1]
+    return node_end(last[1] if isinstance(node, yaml.MappingNode) else last)
+
+def patch_support(text, changes):
+    """The text of data.yaml with the support of some macros replaced, and every other
+    character kept. changes maps (macro name, impl) to a list of SupportItem, or None.
+    The patched sections are parsed again to check that nothing else changed."""
+    names = {name for name, impl in changes}
+    parts = split_sections(text)
+    # The sections run to the end of the text, after whatever precedes the first of them.
+    spans, patched, offset = [], [], len(text) - sum(map(len, parts.values()))
+    for section, part in parts.items():
+        # Only the sections that define one of the macros are composed.
+        if names & set(re.findall(r'^\s*-?\s*name:\s*(\S+)\s*$', part, re.M)):
+            patched.append(section)
+            for kind, macros in yaml.compose(part, Loader=yaml_loader).value:
+                for node in macros.value:
+                    fields = {key.value: value for key, value in node.value}
+                    name = fields['name'].value
+                    for key, value in fields['support'].value:
+                        if (name, key.value) in changes:
+                            spans.append((offset + key.start_mark.index, offset + node_end(value),
+                                          dump_support(key.value, changes[name, key.value], key.start_mark.column)))
+        offset += len(part)
+    if len(spans) != len(changes):
+        raise DataPatchError(f'{len(changes)} support entries to replace, but {len(spans)} found in data.yaml')
+
+    out, pos = [], 0
+    for start, end, replacement in spans:
+        out += [text[pos:start], replacement]
+        pos = end
+    out.append(text[pos:])
+    result = ''.join(out)
+
+    expected = parse_data(text, patched)
+    for macros in expected.values():
+        for macro in macros:
+            for impl in macro['support']:
+                if (macro['name'], impl) in changes:
+                    items = changes[macro['name'], impl]
+                    macro['support'][impl] = None if items is None else [item.to_dict() for item in items]
+    if parse_data(result, patched) != expected:
+        raise DataPatchError('the patched data does not parse to the expected support')
+    return result
+
+def import_support(text, db, impl, imported):
+    """The text of data.yaml with support.<impl> replaced for the macros in imported, which
+    maps macro names to lists of SupportItem, or to None if unsupported; db is the FeatureDB
+    of text. Returns the new text and the number of changed entries."""
+    changes = {}
+    for name, support in imported.items():
+        macro = db.macro(name)
+        if not macro:
+            print(f"warning: cannot find macro {name}", file=sys.stderr)
+        elif support != macro.support[impl]:
+            changes[name, impl] = support
+    return patch_support(text, changes), len(changes)
+
+def run_importer(impl, read_snapshot, input_help):
+    """The command line of the scripts that update support.<impl> of the library macros from
+    the sources of an implementation. read_snapshot(path) reads the support entries from a
+    snapshot of the sources, and raises OSError or ValueError if it cannot."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='+', metavar='FILE', help=f'{input_help}, and the output file name unless --batch is given')
+    parser.add_argument('--batch', metavar='DIR', help='Read each of several snapshots, and write data.yaml updated from each to DIR/<name of the snapshot>.yaml')
+    args = parser.parse_args()
+    if args.batch:
+        outputs = [pathlib.Path(args.batch) / f'{pathlib.Path(path).resolve().name}.yaml' for path in args.files]
+        if len(set(outputs)) != len(outputs):
+            parser.error('the snapshots of a batch must have distinct names')
+        snapshots = list(zip(args.files, outputs))
+    elif len(args.files) == 2:
+        snapshots = [tuple(args.files)]
+    else:
+        parser.error('expected an input and an output file name')
+
+    text = open('data.yaml', encoding='utf-8').read()
+    db = FeatureDB(parse_data(text, ['library']))
+    for path, output in snapshots:
+        try:
+            imported = read_snapshot(path)
+            # Only the changed entries are rewritten, so that the rest of the file stays as it is.
+            updated, count = import_support(text, db, impl, imported)
+        except (OSError, ValueError, DataPatchError) as e:
+            sys.exit(f'error: {e}')
+        pathlib.Path(output).parent.mkdir(parents=True, exist_ok=True)
+        open(output, 'w', encoding='utf-8').write(updated)
+        if args.batch:
+            print(f'{path}: {count} changed support entries written to {output}')
+
+def locate_source(path, candidates):
+    """path if it is a file, else the first of the relative paths candidates that exists in
+    the directory path, e.g. a checkout of the sources of an implementation."""
+    path = pathlib.Path(path)
+    if path.is_dir():
+        for candidate in candidates:
+            if (path / candidate).is_file():
+                return path / candidate
+        raise FileNotFoundError(f"{path} contains none of {', '.join(candidates)}")
+    return path
+
+pp_line = re.compile(r'\s*#\s*(\w+)\s*(.*)')
+commented_define = re.compile(r'\s*//\s*#\s*define\s+(__cpp_lib_\w+)')
+
+def split_conjunction(condition):
+    """The operands of the top-level && of a condition; the condition itself if it has a
+    top-level || or none at all."""
+    operands, depth, start = [], 0, 0
+    for match in re.finditer(r'\(|\)|&&|\|\|', condition):
+        if match[0] == '(':
+            depth += 1
+        elif match[0] == ')':
+            depth -= 1
+        elif depth == 0 and match[0] == '||':
+            return [condition.strip()]
+        elif depth == 0:
+            operands.append(condition[start:match.start()].strip())
+            start = match.end()
+    return [*operands, condition[start:].strip()]
+
+def strip_parentheses(condition):
+    """condition without the parentheses around all of it, if any."""
+    while condition.startswith('(') and condition.endswith(')'):
+        depth = 0
+        for char in condition[1:-1]:
+            depth += {'(': 1, ')': -1}.get(char, 0)
+            if depth < 0:
+                return condition
+        condition = condition[1:-1].strip()
+    return condition
+
+def negate_condition(condition):
+    return f'!{condition}' if re.fullmatch(r'\w+(\(\w+\))?', condition) else f'!({condition})'
+
+def scan_feature_macros(text, classify):
+    """Read the support entries of the __cpp_lib_ macros that a header defines, in one pass
+    over its #if structure. Each operand of the && of an enclosing condition is passed to
+    classify, which returns the standard it gates (e.g. 'C++20'), True or False if it holds
+    in every or no configuration data.yaml is about, or None; the standards give `since`,
+    the other operands `depends`. An #undef removes the entries it applies to in full. Macros that are
+    only defined in comments, as libc++ does for the unimplemented ones, map to None."""
+    text = re.sub(r'/\*.*?\*/', lambda match: '\n' * match[0].count('\n'), text, flags=re.S)
+    text = re.sub(r'\\\n', ' ', text)
+    # Each open #if is a list of (condition, negated) that hold in its current branch;
+    # the condition of an include guard is None.
+    stack = []
+    support, commented = {}, set()
+    guard = None
+    for line in text.splitlines():
+        match = commented_define.match(line)
+        if match:
+            commented.add(match[1])
+            continue
+        match = pp_line.match(line.split('//', 1)[0])
+        if not match:
+            continue
+        directive, rest = match[1], match[2].strip()
+        if directive in ['if', 'ifdef', 'ifndef']:
+            stack.append([(rest if directive == 'if' else f'defined({rest})', directive == 'ifndef')])
+            guard = rest if directive == 'ifndef' else None
+            continue
+        elif directive in ['elif', 'else']:
+            condition, negated = stack[-1][-1]
+            stack[-1][-1] = (condition, not negated)
+            if directive == 'elif':
+                stack[-1].append((rest, False))
+        elif directive == 'endif':
+            stack.pop()
+        elif directive == 'define' and rest.split()[:1] == [guard]:
+            stack[-1] = [(None, False)]
+        elif directive in ['define', 'undef'] and rest.startswith('__cpp_lib_'):
+            name, _, value = rest.partition(' ')
+            since, depends, dead = None, [], False
+            for condition, negated in (condition for frame in stack for condition in frame if condition[0] is not None):
+                # A negated conjunction is not a conjunction, so it is classified as a whole.
+                for operand in [condition] if negated else split_conjunction(condition):
+                    kind = classify(strip_parentheses(operand))
+                    if kind is None:
+                        depends.append(negate_condition(condition) if negated else operand)
+                    elif kind is True or kind is False:
+                        dead = dead or kind == negated
+                    elif not negated and (since is None or standard_index[kind] > standard_index[since]):
+                        since = kind
+            depends = ' && '.join(f'({operand})' if len(depends) > 1 and '||' in operand else operand for operand in depends) or None
+            if directive == 'undef':
+                # Only the entries the #undef applies to in full are cleared; a conditional one is
+                # normally followed by a #define of the new value, which supersedes the old entries.
+                if not dead and name in support:
+                    support[name] = [item for item in support[name] if depends not in [None, item.depends] or
+                                     since is not None and (item.since is None or standard_index[item.since] < standard_index[since])]
+                    if not support[name]:
+                        del support[name]
+                continue
+            if not re.fullmatch(r'\d+[uUlL]*', value.strip()):
+                raise ValueError(f'{name} is defined to {value.strip()!r}, which is not a number')
+            if dead:
+                continue
+            row = {'since': since, 'depends': depends, 'value': int(value.strip().rstrip('uUlL'))}
+            item = SupportItem(**{key: value for key, value in row.items() if value is not None})
+            items = support.setdefault(name, [])
+            if item not in items:
+                items.append(item)
+        guard = None
+    for name in commented - set(support):
+        support[name] = None
+    # expected_value takes the last entry that applies, so later standards come last.
+    return {name: items and sorted(items, key=lambda item: -1 if item.since is None else standard_index[item.since])
+            for name, items in support.items()}
+
+def add_selection_arguments(parser):
+    """Add the options that select a subset of the macros, see select_macros."""
+    group = parser.add_argument_group('macro selection', 'Only process the macros that meet all of the given criteria.')
+    group.add_argument('--macro', metavar='GLOB', nargs='+', help='Names of the macros, as glob patterns, e.g. "__cpp_lib_ranges*"')
+    group.add_argument('--paper', nargs='+', help='Papers that introduced or changed the macros, with or without revision, e.g. P1774R8 or P1774')
+    group.add_argument('--since-std', metavar='STD', choices=[std for std, __cplusplus in standards], help='Macros with a value for this standard or a later one')
+    group.add_argument('--impl-unsupported', metavar='IMPL', choices=implementations, help='Macros that the implementation does not support at all')
+
+def select_macros(macros, args):
+    """The macros that meet the criteria of the options added by add_selection_arguments."""
+    if args.macro:
+        macros = [macro for macro in macros if any(fnmatch.fnmatchcase(macro.name, pattern) for pattern in args.macro)]
+    if args.paper:
+        papers = [re.compile(rf'{re.escape(paper)}(R\d+)?', re.I) for paper in args.paper]
+        macros = [macro for macro in macros if any(paper.fullmatch(cited) for paper in papers for cited in macro.papers())]
+    if args.since_std:
+        macros = [macro for macro in macros if any(standard_index[infer_std(row)] >= standard_index[args.since_std] for row in macro.rows)]
+    if args.impl_unsupported:
+        macros = [macro for macro in macros if not macro.support[args.impl_unsupported]]
+    return macros
+
 def std_options(impl):
     for std, __cplusplus in standards:
         if std == 'C++29':
@@ -33,13 +443,13 @@ def std_options(impl):
             yield std, f'-std={std.lower()}'
 
 def get_options(item):
-    for opt in item.get('option', '').split():
+    for opt in (item.option or '').split():
         yield opt
         yield negate_option(opt)
-    if 'enabled-by' in item:
-        yield item['enabled-by']
-    if 'disabled-by' in item:
-        yield item['disabled-by']
+    if item.enabled_by is not None:
+        yield item.enabled_by
+    if item.disabled_by is not None:
+        yield item.disabled_by
 
 def to_identifier(option):
     if option.startswith('/') and option.endswith('-'):
@@ -65,16 +475,23 @@ def negate_option(option):
         return option + '-'
 
 class TestsuiteGenerator:
-    def __init__(self, kind, impl):
+    """Writes preprocessor tests to `out` (any object with a write method), or
+    collects them in a buffer that can be read back through `output`."""
+    def __init__(self, kind, impl, out=None):
         assert kind in kinds
         assert impl in implementations
         self.depth = 0
-        self.output = ''
+        self.buffer = [] if out is None else None
+        self.write = self.buffer.append if out is None else out.write
         self.kind = kind
         self.impl = impl
 
+    @property
+    def output(self):
+        return ''.join(self.buffer)
+
     def writeln(self, output):
-        self.output += output+'\n'
+        self.write(output + '\n')
 
     def start_if(self, condition):
         space = ' ' * self.depth
@@ -119,67 +536,233 @@ class TestsuiteGenerator:
 
     def generate_test_item(self, macro):
         self.writeln(f"")
-        self.writeln(f"// {macro['name']}")
-        items = list(reversed(macro['support'][self.impl] or []))
+        self.writeln(f"// {macro.name}")
+        items = list(reversed(macro.support[self.impl] or []))
 
         has_condition = [True] * len(items)
         for index, item in enumerate(items):
-            condition = []
-            if 'since' in item:
-                index = [i for i, [std, _] in enumerate(standards) if std == item['since']][0]
-                condition.append(f"__cplusplus > {standards[index - 1][1]}")
-            if 'enabled-by' in item:
-                assert ' ' not in item['enabled-by']
-                condition.append(to_identifier(item['enabled-by']))
-            if 'disabled-by' in item:
-                assert ' ' not in item['disabled-by']
-                condition.append('!' + to_identifier(item['disabled-by']))
-            if 'depends' in item:
-                condition.append(f"({item['depends']})")
-            if 'pedantic' in item:
-                assert item['pedantic'] == False
-                condition.append(nonpedantic_option())
-
-            if 'option' in item:
-                option = item['option'].split()
+            condition = item_conditions(item)
+
+            if item.option is not None:
+                option = item.option.split()
                 hasopt = [to_identifier(opt) for opt in option]
                 hasinvopt = [to_identifier(negate_option(opt)) for opt in option]
 
                 self.start_if(' && '.join([*condition, f"({' || '.join(hasopt)})"]))
-                self.generate_positive_test(macro['name'], item['value'])
+                self.generate_positive_test(macro.name, item.value)
                 self.start_elif(' && '.join([*condition, f"({' || '.join(hasinvopt)})"]))
-                self.generate_negative_test(macro['name'])
+                self.generate_negative_test(macro.name)
                 self.start_else()
             elif len(condition) > 0:
                 self.start_if(' && '.join(condition))
-                self.generate_positive_test(macro['name'], item['value'])
+                self.generate_positive_test(macro.name, item.value)
                 self.start_else()
             else:
-                self.generate_positive_test(macro['name'], item['value'])
+                self.generate_positive_test(macro.name, item.value)
                 has_condition[index] = False
 
         if len(items) == 0 or has_condition[-1]:
-            self.generate_negative_test(macro['name'])
+            self.generate_negative_test(macro.name)
 
         for index, item in enumerate(items):
             if has_condition[index]:
                 self.endif()
 
     def make_options(self, macro):
-        items = macro['support'][self.impl] or []
+        items = macro.support[self.impl] or []
         yield []
         for item in items:
             for opt in get_options(item):
                 yield [opt, f"-D{to_identifier(opt)}=1"]
 
     def pedantic_options(self, macro):
-        items = macro['support'][self.impl] or []
-        if any('pedantic' in item for item in items):
+        items = macro.support[self.impl] or []
+        if any(item.pedantic is not None for item in items):
             return ['-pedantic', f"-D{nonpedantic_option()}=1"]
         else:
             return None
 
+def item_conditions(item):
+    condition = []
+    if item.since is not None:
+        condition.append(f"__cplusplus > {standards[standard_index[item.since] - 1][1]}")
+    if item.enabled_by is not None:
+        assert ' ' not in item.enabled_by
+        condition.append(to_identifier(item.enabled_by))
+    if item.disabled_by is not None:
+        assert ' ' not in item.disabled_by
+        condition.append('!' + to_identifier(item.disabled_by))
+    if item.depends is not None:
+        condition.append(f"({item.depends})")
+    if item.pedantic is not None:
+        assert item.pedantic == False
+        condition.append(nonpedantic_option())
+    return condition
+
+def parse_macro_dump(text):
+    """Parse the output of `-dM -E` into a dict that maps each macro name to its
+    replacement list (None for function-like macros)."""
+    macros = {}
+    for line in text.splitlines():
+        match = re.match(r'#define (\w+)(\(.*?\))? ?(.*)', line)
+        if match:
+            macros[match[1]] = None if match[2] else match[3]
+    return macros
+
+pp_token = re.compile(r'''\s*(?:(0[xX][0-9a-fA-F]+|[0-9]+)[uUlL]*|([A-Za-z_]\w*)|(&&|\|\||==|!=|<=|>=|<<|>>|[-+*/%<>!~&|^()?:]))''')
+
+binary_operators = {
+    '||': (1, lambda lhs, rhs: int(bool(lhs or rhs))),
+    '&&': (2, lambda lhs, rhs: int(bool(lhs and rhs))),
+    '|': (3, lambda lhs, rhs: lhs | rhs),
+    '^': (4, lambda lhs, rhs: lhs ^ rhs),
+    '&': (5, lambda lhs, rhs: lhs & rhs),
+    '==': (6, lambda lhs, rhs: int(lhs == rhs)),
+    '!=': (6, lambda lhs, rhs: int(lhs != rhs)),
+    '<': (7, lambda lhs, rhs: int(lhs < rhs)),
+    '>': (7, lambda lhs, rhs: int(lhs > rhs)),
+    '<=': (7, lambda lhs, rhs: int(lhs <= rhs)),
+    '>=': (7, lambda lhs, rhs: int(lhs >= rhs)),
+    '<<': (8, lambda lhs, rhs: lhs << rhs),
+    '>>': (8, lambda lhs, rhs: lhs >> rhs),
+    '+': (9, lambda lhs, rhs: lhs + rhs),
+    '-': (9, lambda lhs, rhs: lhs - rhs),
+    '*': (10, lambda lhs, rhs: lhs * rhs),
+    '/': (10, lambda lhs, rhs: int(lhs / rhs)),
+    '%': (10, lambda lhs, rhs: lhs - rhs * int(lhs / rhs)),
+}
+
+def tokenize_condition(expr):
+    tokens, pos, expr = [], 0, expr.rstrip()
+    while pos < len(expr):
+        match = pp_token.match(expr, pos)
+        if not match:
+            raise ValueError(f'cannot tokenize {expr[pos:]!r}')
+        number, name, op = match.groups()
+        if number is not None:
+            tokens.append(int(number, 16 if number[:2] in ['0x', '0X'] else 8 if number[0] == '0' else 10))
+        else:
+            tokens.append(name or op)
+        pos = match.end()
+    return tokens
+
+def expand_condition(tokens, macros, hidden=frozenset()):
+    result, pos = [], 0
+    while pos < len(tokens):
+        token = tokens[pos]
+        pos += 1
+        if token == 'defined':
+            parenthesized = int(pos < len(tokens) and tokens[pos] == '(')
+            name = tokens[pos + parenthesized] if pos + parenthesized < len(tokens) else None
+            if not (isinstance(name, str) and name.isidentifier()):
+                raise ValueError('expected a macro name after defined')
+            pos += 1 + parenthesized
+            if parenthesized:
+                if pos == len(tokens) or tokens[pos] != ')':
+                    raise ValueError(f"expected ')' after defined({name}")
+                pos += 1
+            result.append(int(name in macros))
+        elif not isinstance(token, str) or not token.isidentifier():
+            result.append(token)
+        elif token in ['true', 'false']:
+            result.append(int(token == 'true'))
+        elif token in macros and token not in hidden:
+            if macros[token] is None:
+                raise ValueError(f'cannot expand function-like macro {token}')
+            result += expand_condition(tokenize_condition(macros[token]), macros, hidden | {token})
+        elif pos < len(tokens) and tokens[pos] == '(':
+            raise ValueError(f'cannot evaluate {token}(...)')
+        else:
+            result.append(0)
+    return result
+
+def evaluate_condition(expr, macros):
+    """Evaluate an #if expression, given the macros defined at that point (as
+    returned by parse_macro_dump). Raises ValueError if it cannot be evaluated
+    without a compiler, e.g. because it uses __has_builtin."""
+    try:
+        tokens = expand_condition(tokenize_condition(expr), macros)
+    except ValueError as e:
+        raise ValueError(f'{e} in {expr!r}') from None
+    pos = 0
+
+    def expect(token):
+        nonlocal pos
+        if pos == len(tokens) or tokens[pos] != token:
+            raise ValueError(f'expected {token!r} in {expr!r}')
+        pos += 1
+
+    def primary():
+        nonlocal pos
+        if pos == len(tokens):
+            raise ValueError(f'unexpected end of {expr!r}')
+        token = tokens[pos]
+        pos += 1
+        if token == '(':
+            value = conditional()
+            expect(')')
+            return value
+        elif token == '!':
+            return int(not primary())
+        elif token == '~':
+            return ~primary()
+        elif token == '-':
+            return -primary()
+        elif token == '+':
+            return primary()
+        elif isinstance(token, int):
+            return token
+        raise ValueError(f'unexpected {token!r} in {expr!r}')
+
+    def binary(precedence):
+        nonlocal pos
+        lhs = primary()
+        while pos < len(tokens) and tokens[pos] in binary_operators and binary_operators[tokens[pos]][0] >= precedence:
+            token = tokens[pos]
+            op_precedence, op = binary_operators[token]
+            pos += 1
+            rhs = binary(op_precedence + 1)
+            if token in ['/', '%'] and rhs == 0:
+                raise ValueError(f'division by zero in {expr!r}')
+            lhs = op(lhs, rhs)
+        return lhs
+
+    def conditional():
+        nonlocal pos
+        value = binary(1)
+        if pos < len(tokens) and tokens[pos] == '?':
+            pos += 1
+            then = conditional()
+            expect(':')
+            otherwise = conditional()
+            value = then if value else otherwise
+        return value
+
+    value = conditional()
+    if pos != len(tokens):
+        raise ValueError(f'unexpected {tokens[pos]!r} in {expr!r}')
+    return value
+
+def expected_value(macro, impl, macros):
+    """The value of the macro that the test written by TestsuiteGenerator.generate_test_item
+    accepts, given the macros defined in a configuration; None if it must not be defined."""
+    for item in reversed(macro.support[impl] or []):
+        condition = all([evaluate_condition(cond, macros) for cond in item_conditions(item)])
+        if item.option is not None:
+            option = item.option.split()
+            if condition and any(evaluate_condition(to_identifier(opt), macros) for opt in option):
+                return item.value
+            elif condition and any(evaluate_condition(to_identifier(negate_option(opt)), macros) for opt in option):
+                return None
+        elif condition:
+            return item.value
+    return None
+
 def infer_std(row):
+    return infer_std_from_value(row.value)
+
+@functools.cache
+def infer_std_from_value(value):
     for std, __cplusplus in standards:
-        if __cplusplus is None or row['value'] <= __cplusplus:
+        if __cplusplus is None or value <= __cplusplus:
             return std